@@ -0,0 +1,130 @@
+"""Generates synthetic documents that stress different parts of the pipeline.
+
+Each generator takes a scale (1 is a modest page, the browser should stay usable
+well beyond 10) and returns a dict of file name to contents. The HTML page is
+always "index.html"; any other files are subresources it links to.
+"""
+import random
+
+WORDS = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur",
+         "adipiscing", "elit", "sed", "do", "eiusmod", "tempor"]
+TAGS = ["div", "p", "b", "i", "span", "section", "small", "big"]
+ENTITIES = ["&amp;", "&lt;", "&gt;", "&nbsp;", "&copy;", "&eacute;", "&mdash;",
+            "&hellip;", "&laquo;", "&raquo;", "&euro;", "&frac12;"]
+
+
+def page(body: str, head: str = "") -> str:
+    return f"<!doctype html><html><head>{head}</head><body>{body}</body></html>"
+
+
+def words(rng: random.Random, count: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+
+def deep_nesting(scale: int) -> dict:
+    """Blocks and inline elements nested thousands of levels deep"""
+    depth = 1000 * scale
+    body = "".join(f"<div><b>level {i} " for i in range(depth)) + \
+        "</b></div>" * depth
+    return {"index.html": page(body)}
+
+
+def wide_list(scale: int) -> dict:
+    """One flat list with many short items"""
+    rng = random.Random(1)
+    items = "".join(f"<li>{words(rng, 5)}</li>" for _ in range(5000 * scale))
+    return {"index.html": page(f"<ul>{items}</ul>")}
+
+
+def soft_hyphens(scale: int) -> dict:
+    """Long paragraphs of long words with many soft hyphen break points"""
+    rng = random.Random(2)
+
+    def long_word():
+        return "&shy;".join(rng.choice(WORDS) for _ in range(rng.randint(4, 12)))
+
+    paragraphs = "".join(
+        "<p>" + " ".join(long_word() for _ in range(200)) + "</p>"
+        for _ in range(20 * scale))
+    return {"index.html": page(paragraphs)}
+
+
+def big_stylesheet(scale: int) -> dict:
+    """A linked stylesheet with many descendant selectors, applied to moderately nested markup"""
+    rng = random.Random(3)
+    properties = ["color: red", "color: blue", "font-weight: bold", "font-style: italic",
+                  "font-size: 110%", "font-size: 14px", "background-color: gray"]
+
+    rules = []
+    for _ in range(2000 * scale):
+        selector = " ".join(rng.choice(TAGS)
+                            for _ in range(rng.randint(1, 4)))
+        body = "; ".join(rng.sample(properties, 2))
+        rules.append(f"{selector} {{ {body}; }}")
+
+    def block(depth):
+        if depth == 0:
+            return words(rng, 8)
+        tag = rng.choice(TAGS)
+        return f"<{tag}>" + "".join(block(depth - 1) for _ in range(2)) + f"</{tag}>"
+
+    body = "".join(block(6) for _ in range(10 * scale))
+    return {
+        "index.html": page(body, '<link rel="stylesheet" href="big.css">'),
+        "big.css": "\n".join(rules),
+    }
+
+
+def framework_stylesheet(scale: int) -> dict:
+    """A large stylesheet shaped like a CSS framework's: mostly class selectors, pseudo-classes,
+    selector lists, comments and media queries, which the browser skips, among a few rules it supports"""
+    rng = random.Random(5)
+    classes = [f"{prefix}-{suffix}" for prefix in ["btn", "card", "nav", "col", "text", "bg"]
+               for suffix in ["primary", "secondary", "lg", "sm", "header", "body", "item", "link"]]
+    properties = ["color: #212529", "display: inline-block", "padding: 0.375rem 0.75rem",
+                  "border: 1px solid transparent", "font-size: 1rem", "line-height: 1.5",
+                  "background-color: #0d6efd", "transition: color .15s ease-in-out",
+                  "font-family: \"Helvetica Neue\", Arial, sans-serif", "margin: 0 auto"]
+
+    def rule(selector):
+        body = ";\n  ".join(rng.sample(properties, rng.randint(2, 6)))
+        return f"{selector} {{\n  {body};\n}}"
+
+    chunks = []
+    for i in range(2500 * scale):
+        kind = rng.random()
+        if kind < 0.5:
+            chunks.append(rule(f".{rng.choice(classes)}"))
+        elif kind < 0.7:
+            chunks.append(rule(f".{rng.choice(classes)}:hover, .{rng.choice(classes)}:focus"))
+        elif kind < 0.8:
+            chunks.append(rule(" ".join(rng.choice(TAGS) for _ in range(rng.randint(1, 3)))))
+        elif kind < 0.9:
+            chunks.append(f"/* {words(rng, 12)} */")
+        else:
+            chunks.append("@media (min-width: 768px) {\n" +
+                          "\n".join(rule(f".{rng.choice(classes)}") for _ in range(3)) + "\n}")
+
+    return {
+        "index.html": page(words(rng, 50), '<link rel="stylesheet" href="framework.css">'),
+        "framework.css": "\n".join(chunks),
+    }
+
+
+def entities(scale: int) -> dict:
+    """Text dense with character entities"""
+    rng = random.Random(4)
+    paragraphs = "".join(
+        "<p>" + " ".join(f"{rng.choice(WORDS)}{rng.choice(ENTITIES)}" for _ in range(200)) + "</p>"
+        for _ in range(50 * scale))
+    return {"index.html": page(paragraphs)}
+
+
+CORPORA = {
+    "deep_nesting": deep_nesting,
+    "wide_list": wide_list,
+    "soft_hyphens": soft_hyphens,
+    "big_stylesheet": big_stylesheet,
+    "framework_stylesheet": framework_stylesheet,
+    "entities": entities,
+}
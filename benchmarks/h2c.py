@@ -0,0 +1,279 @@
+"""A stand-in HTTP/2 server, for checking http2.py and hpack.py without the network.
+
+It speaks cleartext HTTP/2 (h2c) to clients with prior knowledge, serving responses
+from a dict of paths. Its header blocks use the dynamic table and Huffman coding, which
+the client's own encoder never does, so the client's decoder gets exercised too. A few
+paths send responses the way some servers do: padded, split into CONTINUATION frames,
+after an informational response, or not at all, and a couple send frames too short to
+read. Run from the repository root:
+
+    python -m benchmarks.h2c
+
+to fetch from it through request.fetch_response and check what comes back. The exit
+status is 1 if any check fails. Other scripts can use serve() to stand in for a server.
+"""
+import socket
+import socketserver
+import struct
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, sleep
+
+from hpack import (HUFFMAN_CODE_LENGTHS, HUFFMAN_CODES, STATIC_INDEX, STATIC_TABLE,
+                   Decoder, encode_integer)
+from http2 import (ACK, CONTINUATION, DATA, DEFAULT_MAX_FRAME_SIZE, DEFAULT_WINDOW_SIZE,
+                   END_HEADERS, END_STREAM, GOAWAY, HEADERS, MAX_STREAM_ID, PADDED, PING,
+                   PREFACE, PRIOR_KNOWLEDGE, RST_STREAM, SETTINGS, WINDOW_SIZE, WINDOW_UPDATE,
+                   HTTP2Connection, HTTP2Error)
+from request import extract_response_info, fetch_response
+
+# DATA frames of the padded response, each padded out to the maximum frame size. together
+# they fill half the client's window, so it has to acknowledge them, padding included.
+PADDED_FRAMES = WINDOW_SIZE // 2 // DEFAULT_MAX_FRAME_SIZE
+MAX_PADDING = 255
+
+
+def huffman_string(text: str) -> bytes:
+    bits = length = 0
+    for byte in text.encode("utf-8"):
+        bits = bits << HUFFMAN_CODE_LENGTHS[byte] | HUFFMAN_CODES[byte]
+        length += HUFFMAN_CODE_LENGTHS[byte]
+    # padded to a whole byte with the start of the end of string code, which is all ones
+    padding = -length % 8
+    bits = bits << padding | (1 << padding) - 1
+    data = bits.to_bytes((length + padding) // 8, "big")
+    return encode_integer(len(data), 7, 0x80) + data
+
+
+class IndexingEncoder:
+    """Adds every header to the dynamic table, and refers to it there from then on"""
+
+    def __init__(self):
+        # mirrors the client's table, evicting the same entries it does
+        self.table = Decoder()
+
+    def encode(self, headers) -> bytes:
+        block = bytearray()
+        for name, value in headers:
+            if (name, value) in STATIC_INDEX:
+                block += encode_integer(STATIC_INDEX[(name, value)], 7, 0x80)
+            elif (name, value) in self.table.dynamic_table:
+                index = len(STATIC_TABLE) + 1 + self.table.dynamic_table.index((name, value))
+                block += encode_integer(index, 7, 0x80)
+            else:
+                # literal with incremental indexing, with a new name
+                block += bytes([0x40]) + huffman_string(name) + huffman_string(value)
+                self.table.add(name, value)
+        return bytes(block)
+
+
+class H2CHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        reader = self.request.makefile("rb")
+        if reader.read(len(PREFACE)) != PREFACE:
+            return
+        with self.server.lock:
+            self.server.connections += 1
+
+        self.decoder = Decoder()
+        self.encoder = IndexingEncoder()
+        self.send_frame(SETTINGS, 0, 0)
+        # the header block being continued, if any
+        fragments = []
+        while True:
+            header = reader.read(9)
+            if len(header) < 9:
+                return
+            length = int.from_bytes(header[:3], "big")
+            type, flags = header[3], header[4]
+            stream_id = int.from_bytes(header[5:], "big") & MAX_STREAM_ID
+            payload = reader.read(length)
+
+            if type == SETTINGS and not flags & ACK:
+                self.send_frame(SETTINGS, ACK, 0)
+            elif type == PING and not flags & ACK:
+                self.send_frame(PING, ACK, 0, payload)
+            elif type == WINDOW_UPDATE and stream_id == 0:
+                increment, = struct.unpack("!I", payload)
+                with self.server.lock:
+                    self.server.acknowledged += increment
+            elif type in (HEADERS, CONTINUATION):
+                # the client never pads its headers or gives them priorities
+                fragments.append(payload)
+                if flags & END_HEADERS:
+                    request = dict(self.decoder.decode(b"".join(fragments)))
+                    fragments = []
+                    with self.server.lock:
+                        self.server.requests.append(request)
+                    self.respond(stream_id, request[":path"])
+            elif type == GOAWAY:
+                return
+
+    def send_frame(self, type: int, flags: int, stream_id: int, payload: bytes = b""):
+        header = struct.pack("!IBI", len(payload), flags, stream_id)
+        self.request.sendall(header[1:4] + bytes([type]) + header[4:] + payload)
+
+    def respond(self, stream_id: int, path: str):
+        if path == "/no-response":
+            # ends the stream before sending any headers
+            self.send_frame(DATA, END_STREAM, stream_id)
+            return
+        if path == "/short-reset":
+            # two bytes of the four byte error code
+            self.send_frame(RST_STREAM, 0, stream_id, bytes(2))
+            return
+        if path == "/short-goaway":
+            # the last stream id, but no error code
+            self.send_frame(GOAWAY, 0, 0, struct.pack("!I", stream_id))
+            return
+
+        if path == "/informational":
+            self.send_frame(HEADERS, END_HEADERS, stream_id, self.encoder.encode([
+                (":status", "103"), ("link", "</style.css>; rel=preload")]))
+
+        if path == "/padded":
+            status, body = "200", None
+        elif path.partition("?")[0] in self.server.files:
+            status, body = "200", self.server.files[path.partition("?")[0]]
+        else:
+            status, body = "404", b"not found"
+
+        block = self.encoder.encode([
+            (":status", status),
+            ("content-type", "text/html"),
+            ("x-served-by", "benchmarks.h2c"),
+        ])
+        if path == "/continued":
+            # a byte at a time, the most a client could have to put back together
+            self.send_frame(HEADERS, 0, stream_id, block[:1])
+            for i in range(1, len(block)):
+                self.send_frame(CONTINUATION, END_HEADERS if i == len(block) - 1 else 0,
+                                stream_id, block[i:i + 1])
+        else:
+            self.send_frame(HEADERS, END_HEADERS, stream_id, block)
+
+        if body is None:
+            data = b"x" * (DEFAULT_MAX_FRAME_SIZE - 1 - MAX_PADDING)
+            for i in range(PADDED_FRAMES):
+                flags = PADDED | (END_STREAM if i == PADDED_FRAMES - 1 else 0)
+                self.send_frame(DATA, flags, stream_id,
+                                bytes([MAX_PADDING]) + data + bytes(MAX_PADDING))
+            return
+
+        chunks = [body[i:i + DEFAULT_MAX_FRAME_SIZE]
+                  for i in range(0, len(body), DEFAULT_MAX_FRAME_SIZE)] or [b""]
+        for i, chunk in enumerate(chunks):
+            self.send_frame(DATA, END_STREAM if i == len(chunks) - 1 else 0, stream_id, chunk)
+
+
+class H2CServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, files: dict):
+        super().__init__(("127.0.0.1", 0), H2CHandler)
+        # responses by path, and what clients have done so far
+        self.files = files
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = []
+        self.acknowledged = 0
+
+
+def serve(files: dict) -> H2CServer:
+    """Serves files (a dict of paths to bytes) over h2c on a free port, and tells
+    http2 the server speaks it"""
+    server = H2CServer(files)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    PRIOR_KNOWLEDGE.add(server.server_address)
+    return server
+
+
+def check_hpack() -> list:
+    """Decodes the Huffman coded requests from RFC 7541 appendix C.4, which share a dynamic table"""
+    decoder = Decoder()
+    http = [(":method", "GET"), (":scheme", "http"), (":path", "/"), (":authority", "www.example.com")]
+    https = [(":method", "GET"), (":scheme", "https"), (":path", "/index.html"), (":authority", "www.example.com")]
+    examples = [
+        ("828684418cf1e3c2e5f23a6ba0ab90f4ff", http),
+        ("828684be5886a8eb10649cbf", http + [("cache-control", "no-cache")]),
+        ("828785bf408825a849e95ba97d7f8925a849e95bb8e8b4bf", https + [("custom-key", "custom-value")]),
+    ]
+    return [(f"RFC 7541 C.4.{i} decodes", decoder.decode(bytes.fromhex(block)) == expected)
+            for i, (block, expected) in enumerate(examples, 1)]
+
+
+def check_http2() -> list:
+    page = b"<html><body><p>" + b"hello " * 10_000 + b"</p></body></html>"
+    server = serve({"/": page, "/continued": b"continued", "/informational": b"final"})
+    host, port = server.server_address
+
+    def get(path: str):
+        return extract_response_info(fetch_response("http", host, str(port), path, accept_compressed=False))
+
+    results = []
+    # first, so nothing else received on the connection has been counted against its window yet
+    _, _, _, body = get("/padded")
+    results.append(("padded frames are read", len(body) == PADDED_FRAMES * (DEFAULT_MAX_FRAME_SIZE - 1 - MAX_PADDING)))
+    # on top of the update the client opens the connection's window with
+    expected = WINDOW_SIZE - DEFAULT_WINDOW_SIZE + PADDED_FRAMES * DEFAULT_MAX_FRAME_SIZE
+    # the window update is sent before the response is returned, but read by the server after
+    deadline = monotonic() + 1
+    while server.acknowledged < expected and monotonic() < deadline:
+        sleep(0.01)
+    results.append(("padding is acknowledged", server.acknowledged == expected))
+
+    status, _, headers, body = get("/")
+    results.append(("page comes back whole", status == "200" and body == page.decode()))
+    results.append(("dynamic table entries are decoded", get("/?again")[2] == headers))
+    results.append((":authority includes the port", server.requests[-1][":authority"] == f"{host}:{port}"))
+    results.append(("CONTINUATION frames are put together", get("/continued")[3] == "continued"))
+    status, _, _, body = get("/informational")
+    results.append(("informational responses are skipped", status == "200" and body == "final"))
+    results.append(("missing pages are 404s", get("/missing")[0] == "404"))
+
+    try:
+        get("/no-response")
+        results.append(("a stream without a response is an error", False))
+    except HTTP2Error:
+        results.append(("a stream without a response is an error", True))
+
+    # after the checks that are fine on the first connection, and before those that need a new one
+    connections = server.connections
+    with ThreadPoolExecutor(8) as pool:
+        bodies = list(pool.map(lambda i: get(f"/?{i}")[3], range(32)))
+    results.append(("concurrent requests share a connection",
+                    all(body == page.decode() for body in bodies) and server.connections == connections))
+
+    for path in ["/short-reset", "/short-goaway"]:
+        connections = server.connections
+        try:
+            get(path)
+            results.append((f"{path} is a connection error", False))
+        except HTTP2Error:
+            # the request is tried once more, on a new connection, which fails the same way
+            results.append((f"{path} is a connection error", server.connections == connections + 1))
+
+    # a connection that can't be written to any more
+    connection = HTTP2Connection(socket.create_connection((host, port)))
+    connection.sock.shutdown(socket.SHUT_WR)
+    try:
+        connection.fetch("http", host, port, "/", {})
+        results.append(("a failed write closes the connection", False))
+    except OSError:
+        results.append(("a failed write closes the connection", not connection.usable()))
+
+    server.shutdown()
+    return results
+
+
+def run() -> int:
+    results = check_hpack() + check_http2()
+    for name, ok in results:
+        print(f"{'ok' if ok else 'FAILED':<8}{name}")
+    return 0 if all(ok for _, ok in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(run())
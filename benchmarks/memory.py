@@ -0,0 +1,145 @@
+"""Measures memory used by the DOM, layout tree and display list of a large page.
+
+Run from the repository root (a display is needed for font metrics):
+
+    python -m benchmarks.memory [word count]
+
+Each stage is repeated with dict-backed versions of its slotted classes so the
+savings from slotting them are visible side by side.
+"""
+import gc
+import sys
+import tkinter
+import tracemalloc
+from sys import getsizeof
+from time import perf_counter
+from typing import List
+
+import dom
+import layout
+from browser import cascade_priority, style
+from css import CSSParser
+from dom import HTMLParser, only_body, walk_tree
+
+DOM_CLASSES = ["Element", "Text"]
+PER_WORD_CLASSES = ["TextLayout", "LineLayout", "DrawText", "DrawRect"]
+
+
+def build_page(word_count: int) -> str:
+    words_per_paragraph = 100
+    paragraph = " ".join(["lorem", "<small>ipsum</small>", "<b>dolor</b>", "sit"] *
+                         (words_per_paragraph // 4))
+    paragraphs = [f"<p>{paragraph}</p>"] * \
+        (word_count // words_per_paragraph)
+    return "<html><head></head><body>" + "".join(paragraphs) + "</body></html>"
+
+
+def dict_backed(cls):
+    """A copy of cls without __slots__, so its instances keep their attributes in a __dict__.
+    (A subclass wouldn't do: its instances would still use the inherited slots.)"""
+    slots = set(cls.__dict__.get("__slots__", ()))
+    namespace = {name: value for name, value in cls.__dict__.items()
+                 if name not in slots and name not in ("__slots__", "__dict__", "__weakref__")}
+    return type(cls.__name__, cls.__bases__, namespace)
+
+
+def measure(stage):
+    """Runs stage, returning what it returned along with its memory and GC usage"""
+    gc.collect()
+    collections_before = sum(stat["collections"] for stat in gc.get_stats())
+    tracemalloc.start()
+    start = perf_counter()
+
+    result = stage()
+
+    elapsed = perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    collections = sum(stat["collections"]
+                      for stat in gc.get_stats()) - collections_before
+
+    return result, (current, peak, elapsed, collections)
+
+
+def use_classes(classes: dict):
+    """Swaps in the given classes by name everywhere they've been imported, so that
+    isinstance checks (e.g. browser's `from dom import Text`) see the replacements"""
+    for module in list(sys.modules.values()):
+        for name, cls in classes.items():
+            current = getattr(module, name, None)
+            if isinstance(current, type) and current.__module__ == cls.__module__:
+                setattr(module, name, cls)
+
+
+def compare(title: str, module, class_names: List[str], stage, word_count: int):
+    """Measures stage once with module's classes dict-backed and once slotted"""
+    slotted = {name: getattr(module, name) for name in class_names}
+    variants = [
+        ("dict", {name: dict_backed(cls) for name, cls in slotted.items()}),
+        ("slots", slotted),
+    ]
+
+    print(title)
+    print(f"{'variant':<8}{'retained':>12}{'peak':>12}{'bytes/word':>12}{'gc runs':>10}{'time':>10}")
+    for name, classes in variants:
+        use_classes(classes)
+        # otherwise the second variant would reuse text the first one measured and laid out
+        layout.clear_caches()
+        result, (current, peak, elapsed, collections) = measure(stage)
+        print(f"{name:<8}{current:>12}{peak:>12}{current / word_count:>12.1f}"
+              f"{collections:>10}{elapsed:>9.2f}s")
+
+    # the slotted run went last, so its result is the one handed back
+    return result
+
+
+def report_sharing(nodes, word_count: int):
+    """Shows how much sharing styles and interning tag names saves over every node having its own"""
+    all_nodes = list(walk_tree(nodes))
+    styles = {id(node.style): node.style for node in all_nodes}
+    # a style is a read-only view of a dict, and a copy is what each node would have otherwise
+    style_size = {key: getsizeof(dict(style)) for key, style in styles.items()}
+    unshared = sum(style_size[id(node.style)] for node in all_nodes)
+    print(f"shared styles: {len(styles)} for {len(all_nodes)} nodes, "
+          f"saving {(unshared - sum(style_size.values())) / word_count:.1f} bytes/word")
+
+    # one-character strings are shared by Python anyway
+    tags = [node.tag for node in all_nodes if isinstance(node, dom.Element) and len(node.tag) > 1]
+    distinct = {id(tag): tag for tag in tags}
+    saved = sum(map(getsizeof, tags)) - sum(map(getsizeof, distinct.values()))
+    print(f"interned tags: {len(distinct)} for {len(tags)} elements, saving {saved / word_count:.1f} bytes/word")
+
+
+def run(word_count: int, width: int = 800):
+    # font metrics need a Tk root, but never show the window
+    root = tkinter.Tk()
+    root.withdraw()
+
+    with open("browser.css") as f:
+        rules = sorted(CSSParser(f.read()).parse(), key=cascade_priority)
+    html = build_page(word_count)
+
+    def build_dom():
+        nodes = HTMLParser(html).parse()
+        style(nodes, rules)
+        return nodes
+
+    def build_layout():
+        document = layout.DocumentLayout(only_body(nodes))
+        document.layout(width)
+        display_list = []
+        document.paint(display_list)
+        return document, display_list
+
+    print(f"{word_count} words at width {width}")
+    nodes = compare("parse and style", dom, DOM_CLASSES,
+                    build_dom, word_count)
+    report_sharing(nodes, word_count)
+    compare("layout and paint", layout, PER_WORD_CLASSES,
+            build_layout, word_count)
+
+    root.destroy()
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
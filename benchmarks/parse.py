@@ -0,0 +1,37 @@
+"""Times HTMLParser on pages nested to increasing depths.
+
+Run from the repository root:
+
+    python -m benchmarks.parse [max depth]
+
+Each token should cost the same however deep the parser is, so the time per
+tag should stay flat as the depth grows.
+"""
+import sys
+from time import perf_counter
+
+from dom import HTMLParser
+
+
+def build_nested_page(depth: int) -> str:
+    return "<!doctype html><html><head><title>nested</title></head><body>" + \
+        "<div>text " * depth + "</div>" * depth + "</body></html>"
+
+
+def run(max_depth: int):
+    print(f"{'depth':>8}{'tags':>10}{'time':>10}{'us/tag':>10}")
+    depth = max_depth // 8
+    while depth <= max_depth:
+        html = build_nested_page(depth)
+        tag_count = html.count("<")
+
+        start = perf_counter()
+        HTMLParser(html).parse()
+        elapsed = perf_counter() - start
+
+        print(f"{depth:>8}{tag_count:>10}{elapsed:>9.2f}s{elapsed / tag_count * 1e6:>10.2f}")
+        depth *= 2
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 16_000)
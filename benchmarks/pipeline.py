@@ -0,0 +1,167 @@
+"""Times each stage of the pipeline on the generated corpora in benchmarks/corpus.py.
+
+Runs headlessly (text is measured with HeadlessFont), loading pages over file: URLs
+or, with --http, from a local HTTP server. Run from the repository root:
+
+    python -m benchmarks.pipeline --save-baseline baseline.json
+    ... make changes ...
+    python -m benchmarks.pipeline --baseline baseline.json
+
+Each run starts with the style sheet and layout caches empty, so that every run times
+the work a page loaded for the first time does. With --warm they're kept between runs
+instead, as they would be when going back to a page or loading one much like it.
+
+When comparing against a baseline, any stage that got slower (or any corpus whose
+peak memory grew) by more than the threshold is flagged, and the exit status is 1.
+"""
+import argparse
+import json
+import sys
+import tempfile
+import threading
+import tracemalloc
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from os import makedirs
+from os.path import join
+
+import css
+import domcache
+import layout
+import tracing
+from benchmarks.corpus import CORPORA
+from render import STAGES, init_worker, render_page
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(directory: str) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def write_corpus(directory: str, files: dict):
+    for name, contents in files.items():
+        with open(join(directory, name), "w") as f:
+            f.write(contents)
+
+
+def clear_caches():
+    css.clear_caches()
+    layout.clear_caches()
+
+
+def measure(url: str, width: int, repeat: int, warm: bool = False) -> dict:
+    """Best time of each stage over repeat runs, plus the peak memory of one more traced run.
+    Unless warm, the caches are emptied before each run, or later runs would just be timing cache hits."""
+    best = {}
+    for _ in range(repeat):
+        if not warm:
+            clear_caches()
+        trace = tracing.start()
+        render_page(url, width)
+        tracing.stop()
+        timings = trace.durations()
+        for stage in STAGES:
+            best[stage] = min(best.get(stage, float("inf")),
+                              timings.get(stage, 0))
+
+    # tracing memory slows everything down, so it gets a run of its own
+    if not warm:
+        clear_caches()
+    tracemalloc.start()
+    render_page(url, width)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    best["peak_memory"] = peak
+    return best
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    regressions = []
+    for corpus, measurements in results.items():
+        for metric, value in measurements.items():
+            before = baseline.get(corpus, {}).get(metric)
+            # ignore stages too quick to time reliably
+            if not before or (metric != "peak_memory" and before < 0.001):
+                continue
+            change = value / before - 1
+            if change > threshold:
+                regressions.append((corpus, metric, before, value, change))
+    return regressions
+
+
+def run(args) -> int:
+    init_worker()
+    # repeated runs would otherwise time loading the DOM snapshot saved by the first, not parsing
+    domcache.ENABLED = args.dom_snapshots
+
+    results = {}
+    with tempfile.TemporaryDirectory() as root:
+        server = serve(root) if args.http else None
+
+        for name in args.corpora:
+            directory = join(root, name)
+            makedirs(directory)
+            write_corpus(directory, CORPORA[name](args.scale))
+
+            if server:
+                host, port = server.server_address
+                url = f"http://{host}:{port}/{name}/index.html"
+            else:
+                url = "file://" + join(directory, "index.html")
+
+            results[name] = measure(url, args.width, args.repeat, args.warm)
+
+        if server:
+            server.shutdown()
+
+    print(f"{'corpus':<22}" + "".join(f"{stage:>12}" for stage in STAGES) +
+          f"{'peak MB':>10}")
+    for name, measurements in results.items():
+        print(f"{name:<22}" +
+              "".join(f"{measurements[stage]:>11.3f}s" for stage in STAGES) +
+              f"{measurements['peak_memory'] / 1e6:>10.1f}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for corpus, metric, before, after, change in regressions:
+            print(f"REGRESSION {corpus} {metric}: {before:.4g} -> {after:.4g} (+{change:.0%})")
+        if regressions:
+            return 1
+        print("no regressions")
+
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("corpora", nargs="*", default=list(CORPORA),
+                        help=f"which corpora to run, from {', '.join(CORPORA)}")
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--width", type=int, default=800)
+    parser.add_argument("--http", action="store_true",
+                        help="load pages from a local HTTP server rather than file: URLs")
+    parser.add_argument("--warm", action="store_true",
+                        help="keep the style sheet and layout caches between runs, rather than timing each from cold")
+    parser.add_argument("--dom-snapshots", action="store_true",
+                        help="reuse parsed DOMs saved by earlier runs, see domcache.py")
+    parser.add_argument("--baseline", help="compare against this saved baseline")
+    parser.add_argument("--save-baseline",
+                        help="save these results as a baseline")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="flag changes bigger than this fraction (default 0.2)")
+    sys.exit(run(parser.parse_args()))
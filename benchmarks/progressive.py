@@ -0,0 +1,123 @@
+"""Compares time to first paint with and without progressive stylesheet loading on a slow network.
+
+Serves a page linking several stylesheets from a local HTTP server that holds each
+stylesheet back by a delay, then loads it headlessly in a tab with each setting.
+Run from the repository root:
+
+    python -m benchmarks.progressive --delay 300 --deadline 500
+
+The page is laid out and painted before load returns, so first paint is how long
+load took. Styled is when the last stylesheet was applied (or dropped).
+"""
+import argparse
+import heapq
+import random
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import ThreadingHTTPServer
+from itertools import count
+from time import perf_counter
+
+import domcache
+from benchmarks.corpus import page, words
+from benchmarks.pipeline import QuietHandler, write_corpus
+from browser import Tab
+from layout import use_headless_fonts
+
+
+class ThrottledHandler(QuietHandler):
+    """Holds stylesheets back by the server's delay, as if they came from a slow host"""
+
+    def do_GET(self):
+        if self.path.endswith(".css"):
+            time.sleep(self.server.delay_ms / 1000)
+        super().do_GET()
+
+
+def serve(directory: str, delay_ms: int) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), partial(ThrottledHandler, directory=directory))
+    server.delay_ms = delay_ms
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def slow_stylesheets_page(stylesheets: int) -> dict:
+    rng = random.Random(6)
+    links = "".join(f'<link rel="stylesheet" href="{i}.css">'
+                    for i in range(stylesheets))
+    body = "".join(f"<p>{words(rng, 100)}</p>" for _ in range(50))
+    files = {"index.html": page(body, links)}
+    for i in range(stylesheets):
+        files[f"{i}.css"] = f"p {{ color: {rng.choice(['red', 'blue', 'green'])} }}"
+    return files
+
+
+class EventLoop:
+    """Runs tasks scheduled the way Browser.schedule_tab_task does, without a window"""
+
+    def __init__(self):
+        self.tasks = []
+        self.order = count()
+
+    def schedule(self, task, delay_ms=None):
+        due = perf_counter() + (delay_ms or 0) / 1000
+        heapq.heappush(self.tasks, (due, next(self.order), task))
+
+    def run_until(self, done):
+        while self.tasks and not done():
+            due, _, task = heapq.heappop(self.tasks)
+            time.sleep(max(0, due - perf_counter()))
+            task()
+
+
+def measure(url: str, width: int, progressive: bool, deadline_ms) -> tuple:
+    loop = EventLoop()
+    tab = Tab(width, 600, lambda: None, loop.schedule,
+              progressive_css=progressive, stylesheet_deadline_ms=deadline_ms)
+
+    start = perf_counter()
+    tab.load(url)
+    first_paint = perf_counter() - start
+
+    loop.run_until(lambda: not tab.pending_stylesheets)
+    styled = perf_counter() - start
+    return first_paint, styled
+
+
+def run(args):
+    use_headless_fonts()
+    # otherwise every mode after the first would load the page from the DOM snapshot the first saved
+    domcache.ENABLED = False
+
+    with tempfile.TemporaryDirectory() as root:
+        write_corpus(root, slow_stylesheets_page(args.stylesheets))
+        server = serve(root, args.delay)
+        host, port = server.server_address
+        url = f"http://{host}:{port}/index.html"
+
+        print(f"{args.stylesheets} stylesheets, each delayed {args.delay}ms")
+        print(f"{'mode':<28}{'first paint':>14}{'styled':>12}")
+        modes = [("blocking", False, None),
+                 ("progressive", True, None)]
+        if args.deadline is not None:
+            modes.append((f"progressive, {args.deadline}ms deadline", True, args.deadline))
+
+        for name, progressive, deadline_ms in modes:
+            first_paint, styled = measure(url, args.width, progressive, deadline_ms)
+            print(f"{name:<28}{first_paint * 1000:>12.0f}ms{styled * 1000:>10.0f}ms")
+
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--delay", type=int, default=300,
+                        help="how long the server holds back each stylesheet, in milliseconds")
+    parser.add_argument("--stylesheets", type=int, default=4)
+    parser.add_argument("--deadline", type=int,
+                        help="also measure progressive loading with this stylesheet deadline, in milliseconds")
+    parser.add_argument("--width", type=int, default=800)
+    run(parser.parse_args())
@@ -0,0 +1,69 @@
+"""Keeps recently visited pages fully loaded, so going back to one is instant.
+
+Rather than re-fetching, re-parsing, restyling and laying the page out again, a tab
+stashes a PageSnapshot of the page it navigates away from. The cache is shared by all
+tabs and bounded by an estimate of the memory the snapshots hold on to, evicting the
+least recently stored snapshot first.
+"""
+from collections import OrderedDict
+
+from memory import estimate_page_memory
+
+DEFAULT_MAX_BYTES = 128 * 1024 * 1024
+
+
+class PageSnapshot:
+    """Everything a tab needs to show a page again without loading it"""
+
+    def __init__(self, tab):
+        self.location = tab.location
+        self.url = tab.url
+        self.nodes = tab.nodes
+        self.document = tab.document
+        self.layout_steps = tab.layout_steps
+        self.layout_complete = tab.layout_complete
+        self.layout_index = tab.layout_index
+        self.display_list = tab.display_list
+        self.scroll = tab.scroll
+        self.width = tab.width
+        self.size = estimate_page_memory(self.nodes, self.display_list)
+
+    def restore(self, tab):
+        tab.location = self.location
+        tab.url = self.url
+        tab.nodes = self.nodes
+        tab.document = self.document
+        tab.layout_steps = self.layout_steps
+        tab.layout_complete = self.layout_complete
+        tab.layout_index = self.layout_index
+        tab.display_list = self.display_list
+        tab.scroll = self.scroll
+
+
+class BackForwardCache:
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        # least recently stored first
+        self.snapshots = OrderedDict()
+
+    def put(self, key, snapshot: PageSnapshot):
+        self.discard(key)
+        if snapshot.size > self.max_bytes:
+            return
+
+        self.snapshots[key] = snapshot
+        self.size += snapshot.size
+        while self.size > self.max_bytes:
+            _, evicted = self.snapshots.popitem(last=False)
+            self.size -= evicted.size
+
+    def take(self, key):
+        """Removes and returns the snapshot stored under key, if there is one"""
+        snapshot = self.snapshots.pop(key, None)
+        if snapshot:
+            self.size -= snapshot.size
+        return snapshot
+
+    def discard(self, key):
+        self.take(key)
@@ -1,12 +1,22 @@
+from itertools import count
 from typing import List
+from os.path import dirname, join
+from time import perf_counter
+from types import MappingProxyType
 import tkinter
 import tkinter.font
 
+import domcache
+import tracing
+from bfcache import BackForwardCache, PageSnapshot
+from frames import FrameScheduler
+from memory import estimate_display_list_memory, estimate_dom_memory
 from request import request_url, resolve_url
+from resources import NAVIGATION, RENDER_BLOCKING, SCHEDULER, VISIBLE
 from entities import chars_to_entity
-from layout import VSTEP, DocumentLayout, DrawRect, DrawText, get_font
-from css import DescendantSelector, TagSelector, CSSParser, print_rules
-from dom import Text, Element, HTMLParser, only_body
+from layout import BlockLayout, DocumentLayout, DrawRect, DrawText, LayoutIndex, RenderedPage, deserialize_display_list, get_font
+from css import DescendantSelector, TagSelector, CSSParser, parse_inline_style, print_rules
+from dom import Text, Element, HTMLParser, only_body, walk_tree
 
 
 def escape_html(html: str):
@@ -22,65 +32,93 @@ def build_view_source_html(source: str):
 
 
 INHERITED_PROPERTIES = {
-    "font-size": "16px",
+    # in pixels
+    "font-size": 16.0,
     "font-style": "normal",
     "font-weight": "normal",
     "color": "black",
 }
 
+DEFAULT_STYLE = MappingProxyType(INHERITED_PROPERTIES)
+
 
 def compute_style(node, property, value):
     if property == "font-size":
-        if value.endswith("px"):
-            return value
-        elif value.endswith("%"):
-            if node.parent:
-                parent_font_size = node.parent.style["font-size"]
-            else:
-                parent_font_size = INHERITED_PROPERTIES["font-size"]
-
-            # have to resolve percentage to a pixel value since font-size is a "computed style"
-            # see https://www.w3.org/TR/CSS2/cascade.html#computed-value for more info
-            node_pct = float(value[:-1]) / 100
-            parent_px = float(parent_font_size[:-2])
-            return str(node_pct * parent_px) + "px"
+        if node.parent:
+            parent_font_size = node.parent.style["font-size"]
         else:
-            return None
+            parent_font_size = INHERITED_PROPERTIES["font-size"]
+
+        # have to resolve percentage to a pixel value since font-size is a "computed style"
+        # see https://www.w3.org/TR/CSS2/cascade.html#computed-value for more info
+        return value.resolve(parent_font_size)
     else:
         return value
 
 
 def apply_rule_body(rule_body, node):
     for property, value in rule_body.items():
-        computed_value = compute_style(node, property, value)
-        if not computed_value:
-            continue
-        node.style[property] = computed_value
+        node.style[property] = compute_style(node, property, value)
 
 
 def style(node: Text | Element, rules: List[tuple[TagSelector | DescendantSelector, dict]]):
     # TODO - should this function be invoked from the nodes themselves?
-    node.style = {}
 
-    # inherit properties
-    for property, default_value in INHERITED_PROPERTIES.items():
-        if node.parent:
-            node.style[property] = node.parent.style[property]
-        else:
-            node.style[property] = default_value
+    # computed styles are immutable, so nodes that would compute the same style share one object.
+    # maps (parent style, indices of matched rules) to the style computed for them.
+    shared_styles = {}
+
+    # parents come before their children in document order, so their styles are always ready
+    matched = 0
+    for descendant in walk_tree(node):
+        matched += style_node(descendant, rules, shared_styles)
+    tracing.count("rules matched", matched)
+
+
+def style_node(node: Text | Element, rules: List[tuple[TagSelector | DescendantSelector, dict]], shared_styles: dict) -> int:
+    """Computes node's style, returning how many rules matched it"""
+    if isinstance(node, Text):
+        # text can't be matched by selectors or have inline styles, so it just uses its parent's style
+        node.style = node.parent.style if node.parent else DEFAULT_STYLE
+        return 0
+
+    parent_style = node.parent.style if node.parent else None
+    matched_rules = tuple(i for i, (selector, body) in enumerate(rules)
+                          if selector.matches(node))
+    has_inline_style = "style" in node.attributes
+    key = (id(parent_style), matched_rules)
+
+    if not has_inline_style and key in shared_styles:
+        node.style = shared_styles[key]
+    else:
+        node.style = {}
+
+        # inherit properties
+        for property, default_value in INHERITED_PROPERTIES.items():
+            if node.parent:
+                node.style[property] = node.parent.style[property]
+            else:
+                node.style[property] = default_value
 
-    # apply global CSS rules
-    for selector, body in rules:
-        if selector.matches(node):
+        # apply global CSS rules
+        for i in matched_rules:
+            apply_rule_body(rules[i][1], node)
+
+        # apply inline styles
+        if has_inline_style:
+            body = parse_inline_style(node.attributes["style"])
             apply_rule_body(body, node)
 
-    # apply inline styles
-    if isinstance(node, Element) and "style" in node.attributes:
-        body = CSSParser(node.attributes["style"]).body()
-        apply_rule_body(body, node)
+        # nodes whose computed style ends up identical to their parent's share its object
+        if node.parent and node.style == node.parent.style:
+            node.style = node.parent.style
+        else:
+            node.style = MappingProxyType(node.style)
+
+        if not has_inline_style:
+            shared_styles[key] = node.style
 
-    for child in node.children:
-        style(child, rules)
+    return len(matched_rules)
 
 
 def cascade_priority(rule):
@@ -89,25 +127,159 @@ def cascade_priority(rule):
 
 
 def tree_to_list(tree, list):
-    list.append(tree)
-    for child in tree.children:
-        tree_to_list(child, list)
+    list.extend(walk_tree(tree))
     return list
 
 
+def parse_document(url: str, owner=None):
+    """Fetches and parses the page at url (which may be a view-source: URL), returning its unstyled DOM.
+    owner is the tab it's for, if any, see resources.py."""
+    location = url
+    view_source = url.startswith("view-source:")
+    if view_source:
+        _, url = url.split(':', 1)
+
+    with tracing.span("fetch"):
+        headers, body = SCHEDULER.fetch(url, NAVIGATION, owner)
+
+    # big pages that haven't changed since they were last parsed come back from a snapshot
+    validator = None
+    if domcache.ENABLED and len(body) >= domcache.MIN_SNAPSHOT_LENGTH:
+        validator = domcache.snapshot_validator(url, headers)
+    if validator:
+        nodes = domcache.load_snapshot(location, validator)
+        if nodes:
+            tracing.count("dom snapshot hits")
+            return nodes
+
+    if view_source:
+        body = build_view_source_html(body)
+
+    with tracing.span("parse"):
+        nodes = HTMLParser(body).parse()
+
+    if validator:
+        domcache.save_snapshot(location, validator, nodes)
+    return nodes
+
+
+def find_stylesheet_urls(nodes, url: str) -> List[str]:
+    """The URLs of the stylesheets linked to from the page at url, in document order"""
+    urls = []
+    for node in tree_to_list(nodes, []):
+        if isinstance(node, Element) and node.tag == 'link' and 'href' in node.attributes \
+                and node.attributes.get("rel") == "stylesheet":
+            try:
+                urls.append(resolve_url(node.attributes['href'], url))
+            except ValueError:
+                continue
+    return urls
+
+
+def fetch_stylesheet(url: str) -> list:
+    """Fetches and parses the stylesheet at url, returning its rules, or none if it can't be fetched"""
+    try:
+        header, body = request_url(url)
+    except:
+        return []
+    return CSSParser(body).parse()
+
+
+def style_document(nodes, default_style_sheet, style_sheets):
+    """Styles the DOM with the user agent style sheet, then the rules of each
+    of the page's style sheets, in the order they're linked"""
+    rules = default_style_sheet.copy()
+    for style_sheet in style_sheets:
+        rules.extend(style_sheet)
+
+    with tracing.span("style"):
+        # Note that before sorting rules, it is in file order. Since Python’s sorted function keeps the
+        # relative order of things when possible, file order thus acts as a tie breaker, as it should.
+        # See https://www.w3.org/TR/2011/REC-CSS2-20110607/cascade.html#cascading-order
+        style(nodes, sorted(rules, key=cascade_priority))
+
+
+def load_document(url: str, default_style_sheet, owner=None):
+    """Fetches, parses and styles the page at url (which may be a view-source: URL), returning its DOM.
+    owner is the tab it's for, if any, see resources.py."""
+    nodes = parse_document(url, owner)
+
+    with tracing.span("stylesheets"):
+        # fetched all at once, since the page can't be shown until they're all here
+        futures = [SCHEDULER.submit(fetch_stylesheet, stylesheet_url, RENDER_BLOCKING, owner)
+                   for stylesheet_url in find_stylesheet_urls(nodes, url.removeprefix("view-source:"))]
+        style_sheets = [future.result() for future in futures]
+
+    style_document(nodes, default_style_sheet, style_sheets)
+
+    if tracing.enabled():
+        tracing.count("dom nodes", len(tree_to_list(nodes, [])))
+
+    return nodes
+
+
+def load_default_style_sheet():
+    with open(join(dirname(__file__), "browser.css")) as f:
+        return CSSParser(f.read()).parse()
+
+
+# gives each tab a unique id
+TAB_IDS = count()
+
 SCROLL_STEP = 100
 CHROME_HEIGHT = 100
 
+# canvas tags for the two layers of retained canvas items
+CONTENT_TAG = "content"
+CHROME_TAG = "chrome"
+TAB_STRIP_TAG = "tab-strip"
+
+# how many screens worth of content to lay out before the first paint
+EAGER_LAYOUT_SCREENS = 2
+# the rest of the document is laid out in slices of this many milliseconds while idle
+LAYOUT_SLICE_MS = 10
+# how often to check whether a page rendering in a worker is ready
+RENDER_POLL_MS = 16
+# how often to check whether stylesheets fetched in the background have arrived
+STYLESHEET_POLL_MS = 16
+
 
 class Tab:
-    def __init__(self, width: int, height: int, trigger_render):
+    def __init__(self, width: int, height: int, trigger_render, schedule_task, render_pool=None, bfcache=None,
+                 progressive_css=False, stylesheet_deadline_ms=None):
         self.set_dimensions(width, height)
         self.trigger_render = trigger_render
+        self.schedule_task = schedule_task
+        # when set, pages are rendered in worker processes, see render.py
+        self.render_pool = render_pool
+        self.pending_render = None
+
+        # when set, pages are painted before their linked stylesheets arrive, see load_stylesheets.
+        # stylesheets arriving more than the deadline after the first paint (if given) are dropped.
+        self.progressive_css = progressive_css
+        self.stylesheet_deadline_ms = stylesheet_deadline_ms
+        self.pending_stylesheets = None
+        # when the page being loaded started loading, until its first contentful paint
+        self.load_started = None
+        # whether the page has been scrolled since it started loading, so it's not scrolled back to its fragment
+        self.scrolled_by_user = False
+
+        # pages navigated away from, keyed by (tab id, history index)
+        self.bfcache = bfcache if bfcache is not None else BackForwardCache()
+        self.id = next(TAB_IDS)
+
+        # what has been thrown away to save memory while in the background, see discard
+        self.discarded = None
+        # when the browser last switched to this tab, for discarding the least recently used first
+        self.last_active = 0
+        # the DOM whose size was last estimated, and that estimate, see memory_usage
+        self.measured_nodes = None
+        self.dom_memory = 0
 
         self.history = []
+        self.drawn_count = None
 
-        with open("browser.css") as f:
-            self.default_style_sheet = CSSParser(f.read()).parse()
+        self.default_style_sheet = load_default_style_sheet()
 
     def mousewheel(self, delta: int):
         scroll_delta = SCROLL_STEP * -delta
@@ -117,11 +289,16 @@ class Tab:
             self.scrollup()
 
     def scrolldown(self):
+        # make sure there is content to scroll onto before clamping to the document height
+        self.continue_layout(self.scroll + SCROLL_STEP +
+                             EAGER_LAYOUT_SCREENS * self.height)
         max_y = self.document.height - self.height
         self.scroll = min(self.scroll + SCROLL_STEP, max_y)
+        self.scrolled_by_user = True
 
     def scrollup(self):
         self.scroll = max(self.scroll - SCROLL_STEP, 0)
+        self.scrolled_by_user = True
 
     def set_dimensions(self, width: int, height: int):
         self.width, self.height = width, height
@@ -129,106 +306,368 @@ class Tab:
     def click(self, x: int, y: int):
         y += self.scroll
 
-        layouts = tree_to_list(self.document, [])
-        layouts_under_click = [layout for layout in layouts
-                               if layout.x <= x < layout.x + layout.width
-                               and layout.y <= y < layout.y + layout.height]
-
-        element = layouts_under_click[-1].node
+        # only what's been laid out is indexed, which is usually already past anything on screen
+        self.continue_layout(y)
+        href = self.layout_index.link_at(x, y)
 
-        if not element:
+        if not href:
             return
 
-        while element:
-            if isinstance(element, Text):
-                pass
-            elif element.tag == 'a':
-                href = element.attributes['href']
-                href_url = resolve_url(href, self.url)
-                self.load(href_url)
-                if href.startswith('#'):
-                    for layout in filter(lambda layout: isinstance(layout.node, Element), layouts):
-                        attributes = layout.node.attributes
-                        if 'id' in attributes and attributes['id'] == href[1:]:
-                            self.scroll = layout.y
-                            self.trigger_render()
-
-            element = element.parent
+        href_url = resolve_url(href, self.url)
+        self.load(href_url)
 
     def go_back(self):
         if len(self.history) > 1:
             self.history.pop()
-            back = self.history.pop()
-            self.load(back)
+            # there's no going forward, so the page being left can't be returned to
+            self.bfcache.discard((self.id, len(self.history)))
 
-    def draw(self, canvas: tkinter.Canvas):
-        for command in self.display_list:
-            if command.top > self.scroll + self.height - CHROME_HEIGHT:
-                # falls below the viewport
-                continue
-            if command.bottom + VSTEP < self.scroll:
-                # falls above the viewport
-                continue
+            snapshot = self.bfcache.take((self.id, len(self.history) - 1))
+            if snapshot:
+                self.restore_snapshot(snapshot)
+            else:
+                # loaded again, without stashing the page being left under the wrong history index
+                back = self.history.pop()
+                self.load(back, stash_current=False)
+
+    def save_snapshot(self):
+        """Stashes the current page in the bfcache, in case it's returned to"""
+        if not self.history or self.pending_render or self.pending_stylesheets or self.discarded:
+            # nothing has been loaded yet, it's still loading, or it has been thrown away
+            return
+        self.bfcache.put((self.id, len(self.history) - 1), PageSnapshot(self))
+
+    def restore_snapshot(self, snapshot):
+        self.cancel_loads()
+        self.load_started = None
+        with tracing.span("restore from bfcache"):
+            snapshot.restore(self)
+            self.invalidate_canvas()
+
+            if snapshot.width != self.width:
+                # the window was resized since, so the layout is stale
+                self.build_and_paint_document()
+            else:
+                # the page may have been left before it was fully laid out
+                self.schedule_layout_slice()
+
+    def invalidate_canvas(self):
+        """Forces the next draw to recreate this tab's canvas items from scratch"""
+        self.drawn_count = None
+
+    def draw(self, canvas: tkinter.Canvas) -> bool:
+        # canvas items are created once per display list and moved when scrolling,
+        # rather than being deleted and recreated on every frame.
+        # returns whether any new items were created.
+        if self.drawn_count is None:
+            canvas.delete(CONTENT_TAG)
+            self.drawn_count = 0
+            self.drawn_scroll = self.scroll
+        elif self.drawn_scroll != self.scroll:
+            canvas.move(CONTENT_TAG, 0, self.drawn_scroll - self.scroll)
+            self.drawn_scroll = self.scroll
+
+        new_commands = self.display_list[self.drawn_count:]
+        for command in new_commands:
+            command.execute(self.scroll - CHROME_HEIGHT,
+                            canvas, tags=CONTENT_TAG)
+        self.drawn_count = len(self.display_list)
+
+        if new_commands and self.load_started is not None:
+            if tracing.CURRENT:
+                tracing.CURRENT.add_span(
+                    "first contentful paint", self.load_started, perf_counter() - self.load_started)
+            self.load_started = None
+
+        return len(new_commands) > 0
+
+    def load(self, url: str, stash_current=True):
+        if stash_current:
+            self.save_snapshot()
+        self.history.append(url)
+        self.location = url
+        self.url = url.split(':', 1)[1] if url.startswith("view-source:") else url
+        self.scroll = 0
+        self.scrolled_by_user = False
+        self.load_started = perf_counter()
+        self.cancel_loads()
 
-            command.execute(self.scroll - CHROME_HEIGHT, canvas)
+        if self.render_pool:
+            self.render_in_worker()
+            return
 
-    def load(self, url: str):
-        self.history.append(url)
-        view_source = url.startswith("view-source:")
-        if view_source:
-            _, url = url.split(':', 1)
+        if not self.progressive_css:
+            with tracing.span("load"):
+                self.nodes = load_document(url, self.default_style_sheet, self)
 
-        self.url = url
+            self.build_and_paint_document()
+            self.scroll_to_fragment()
+            return
 
-        headers, body = request_url(url)
+        # the first paint only uses the user agent style sheet
+        with tracing.span("load"):
+            self.nodes = parse_document(url, self)
+            stylesheet_urls = find_stylesheet_urls(self.nodes, self.url)
+            style_document(self.nodes, self.default_style_sheet, [])
 
-        if view_source:
-            body = build_view_source_html(body)
+        self.build_and_paint_document()
+        self.scroll_to_fragment()
+        if stylesheet_urls:
+            self.load_stylesheets(stylesheet_urls)
+
+    def load_stylesheets(self, urls: List[str]):
+        """Fetches the page's linked stylesheets in the background. As each arrives the page
+        is restyled, with the stylesheets that have arrived so far in the order they're linked,
+        and laid out again. Any still missing at the deadline are dropped."""
+        nodes = self.nodes
+        futures = [SCHEDULER.submit(fetch_stylesheet, url, VISIBLE, self)
+                   for url in urls]
+        self.pending_stylesheets = futures
+        # each linked stylesheet's rules, left empty until it arrives
+        style_sheets = [[] for _ in urls]
+        waiting = set(range(len(urls)))
+        deadline = None
+        if self.stylesheet_deadline_ms is not None:
+            deadline = perf_counter() + self.stylesheet_deadline_ms / 1000
+
+        def poll():
+            if futures is not self.pending_stylesheets:
+                # superseded by another navigation, or the page was discarded
+                return
 
-        self.nodes = HTMLParser(body).parse()
+            arrived = [i for i in sorted(waiting) if futures[i].done()]
+            for i in arrived:
+                waiting.remove(i)
+                style_sheets[i] = futures[i].result()
+            if any(style_sheets[i] for i in arrived):
+                self.apply_stylesheets(nodes, style_sheets)
+
+            if not waiting:
+                self.pending_stylesheets = None
+            elif deadline is not None and perf_counter() >= deadline:
+                tracing.count("stylesheets dropped", len(waiting))
+                self.cancel_loads()
+            else:
+                self.schedule_task(poll, STYLESHEET_POLL_MS)
 
-        stylesheet_links = [node.attributes['href']
-                            for node in tree_to_list(self.nodes, [])
-                            if isinstance(node, Element)
-                            and node.tag == 'link'
-                            and 'href' in node.attributes
-                            and node.attributes.get("rel") == "stylesheet"]
+        self.schedule_task(poll, STYLESHEET_POLL_MS)
 
-        rules = self.default_style_sheet.copy()
+    def apply_stylesheets(self, nodes, style_sheets):
+        with tracing.span("restyle"):
+            style_document(nodes, self.default_style_sheet, style_sheets)
 
-        for link in stylesheet_links:
-            try:
-                header, body = request_url(resolve_url(link, url))
-            except:
-                continue
-            rules.extend(CSSParser(body).parse())
+        if self.discarded:
+            # laid out again when the tab is next shown
+            return
+        self.build_and_paint_document()
+        # the stylesheet may have moved the fragment's target, unless the page has been scrolled by hand since
+        if not self.scrolled_by_user:
+            self.scroll_to_fragment()
+        self.trigger_render()
+
+    def cancel_loads(self):
+        """Cancels loads for a page that's being left or thrown away"""
+        SCHEDULER.cancel(self)
+        self.pending_stylesheets = None
+        self.cancel_render()
+
+    def scroll_to_fragment(self):
+        if '#' not in self.url:
+            return
 
-        # Note that before sorting rules, it is in file order. Since Python’s sorted function keeps the
-        # relative order of things when possible, file order thus acts as a tie breaker, as it should.
-        # See https://www.w3.org/TR/2011/REC-CSS2-20110607/cascade.html#cascading-order
-        style(self.nodes, sorted(rules, key=cascade_priority))
+        _, fragment = self.url.split('#', 1)
+        # laid out a slice at a time until the target turns up, rather than all at once
+        target = self.layout_index.find_id(fragment)
+        while target is None and not self.layout_complete:
+            self.continue_layout(deadline=perf_counter() + LAYOUT_SLICE_MS / 1000)
+            target = self.layout_index.find_id(fragment)
+
+        if target is not None:
+            self.scroll = target
+            self.continue_layout(self.scroll + EAGER_LAYOUT_SCREENS * self.height)
+
+    def render_in_worker(self):
+        """Hands the whole pipeline for the current page to the render pool,
+        showing an empty page until the result comes back"""
+        self.apply_rendered_page(RenderedPage())
+        # a render that hasn't started yet for a page or size that's no longer wanted would just hold up the pool
+        self.cancel_render()
+        future = self.render_pool.submit(self.location, self.width)
+        self.pending_render = future
+        submitted = perf_counter()
+
+        def poll():
+            if future is not self.pending_render:
+                # superseded by another navigation or resize
+                return
+            if not future.done():
+                self.schedule_task(poll, RENDER_POLL_MS)
+                return
+            self.pending_render = None
+            if tracing.CURRENT:
+                tracing.CURRENT.add_span(
+                    "render in worker", submitted, perf_counter() - submitted)
+            with tracing.span("apply rendered page"):
+                self.apply_rendered_page(future.result())
+            self.scroll_to_fragment()
+            self.trigger_render()
+
+        self.schedule_task(poll, RENDER_POLL_MS)
+
+    def cancel_render(self):
+        if self.pending_render:
+            # a no-op if a worker has already started on it
+            self.pending_render.cancel()
+            self.pending_render = None
+
+    def apply_rendered_page(self, page):
+        # a page rendered elsewhere has no DOM or layout tree here, just what's needed to draw
+        # it, scroll it and click on it. the page stands in for the document layout.
+        self.nodes = None
+        self.document = page
+        self.layout_steps = iter(())
+        self.layout_complete = True
+        self.layout_index = page.layout_index
+        self.display_list = deserialize_display_list(page.display_list)
+        self.invalidate_canvas()
+
+    def memory_usage(self) -> int:
+        """Estimates the bytes held on to by this tab's current page"""
+        if self.nodes is not self.measured_nodes:
+            # the DOM doesn't change once loaded, so it only needs measuring once
+            self.measured_nodes = self.nodes
+            self.dom_memory = estimate_dom_memory(self.nodes)
+
+        display_list = getattr(self, "display_list", [])
+        return self.dom_memory + estimate_display_list_memory(display_list, serialized=self.nodes is None)
+
+    def discard(self, dom=False):
+        """Frees this background tab's layout tree and display list, and its DOM too if dom is set.
+        They're rebuilt by materialize before the tab is shown again."""
+        self.document = None
+        self.layout_steps = iter(())
+        self.layout_complete = True
+        self.layout_index = None
+        self.display_list = []
+        # a render in a worker can just be asked for again
+        self.cancel_render()
+        self.invalidate_canvas()
+
+        if dom and self.nodes is not None:
+            self.nodes = None
+            # the page is loaded from scratch when it's shown again
+            self.cancel_loads()
+            self.discarded = "dom"
+        elif self.discarded is None:
+            self.discarded = "layout"
+
+    def materialize(self, width: int, height: int):
+        """Brings the tab up to date before it's shown: sized to the window,
+        and with anything discarded while it was in the background rebuilt"""
+        resized = (width, height) != (self.width, self.height)
+        self.set_dimensions(width, height)
 
-        self.scroll = 0
+        if self.discarded == "dom":
+            # comes back from the HTTP cache when the page allows it
+            with tracing.span("reload discarded page"):
+                self.nodes = load_document(
+                    self.location, self.default_style_sheet, self)
 
-        self.build_and_paint_document()
+        if self.discarded or resized:
+            self.discarded = None
+            self.build_and_paint_document()
 
     def build_and_paint_document(self):
+        if self.render_pool:
+            self.render_in_worker()
+            return
+
+        # only enough of the document to fill the first screens is laid out up front,
+        # the rest is laid out in idle slices (or on demand when scrolling)
         self.document = DocumentLayout(only_body(self.nodes))
-        self.document.layout(self.width)
+        self.layout_steps = self.document.layout_steps(self.width)
+        self.layout_complete = False
+        self.layout_index = LayoutIndex()
         self.display_list: List[DrawRect | DrawText] = []
-        self.document.paint(self.display_list)
+        self.invalidate_canvas()
+
+        self.continue_layout(self.scroll + EAGER_LAYOUT_SCREENS * self.height)
+        self.schedule_layout_slice()
+
+    def continue_layout(self, until_y=None, deadline=None):
+        """Lays out and paints more of the document until it reaches until_y (if given),
+        the deadline (if given) passes, or the document is complete"""
+        if self.layout_complete:
+            return
+
+        with tracing.span("layout and paint"):
+            for finished in self.layout_steps:
+                # blocks are finished after everything in them, which has been painted and indexed already
+                if isinstance(finished, BlockLayout):
+                    finished.paint_self(self.display_list)
+                    self.layout_index.add_box(finished)
+                else:
+                    finished.paint(self.display_list)
+                    self.layout_index.add_tree(finished)
+
+                if until_y is not None and self.document.height >= until_y:
+                    return
+                if deadline is not None and perf_counter() >= deadline:
+                    return
+
+            self.layout_complete = True
+            self.document.paint_self(self.display_list)
+            self.layout_index.add_box(self.document)
+            self.layout_index.finish()
+            tracing.count("display list items", len(self.display_list))
+
+    def finish_layout(self):
+        self.continue_layout()
+
+    def schedule_layout_slice(self):
+        if self.layout_complete:
+            return
+
+        layout_steps = self.layout_steps
+
+        def layout_slice():
+            if layout_steps is not self.layout_steps:
+                # the document was laid out again since this was scheduled
+                return
+            self.continue_layout(
+                deadline=perf_counter() + LAYOUT_SLICE_MS / 1000)
+            self.trigger_render()
+            self.schedule_layout_slice()
+
+        self.schedule_task(layout_slice)
 
 
 HOME_PAGE = "https://browser.engineering/"
 
+TAB_MEMORY_BUDGET = 256 * 1024 * 1024
+
 
 class Browser:
-    def __init__(self, initial_width: int, initial_height: int):
+    def __init__(self, initial_width: int, initial_height: int, render_pool=None, show_trace_overlay=False,
+                 progressive_css=False, stylesheet_deadline_ms=None):
         self.width, self.height = initial_width, initial_height
+        self.render_pool = render_pool
+        # see Tab.load_stylesheets
+        self.progressive_css = progressive_css
+        self.stylesheet_deadline_ms = stylesheet_deadline_ms
+        self.bfcache = BackForwardCache()
+        # background tabs are discarded when all tabs are estimated to use more than this, in bytes
+        self.tab_memory_budget = TAB_MEMORY_BUDGET
+        # orders tabs by when they were last activated
+        self.activity = count()
+        self.show_trace_overlay = show_trace_overlay
+        self.trace_overlay = None
         self.window = tkinter.Tk()
         self.canvas = tkinter.Canvas(
             self.window, width=self.width, height=self.height, bg="white")
         self.canvas.pack()
+        # input handlers only update state, then the screen is redrawn at most once a frame
+        self.frames = FrameScheduler(self.window.after, self.draw)
 
         self.tabs = []
         self.active_tab = None
@@ -236,6 +675,11 @@ class Browser:
         self.focus = None
         self.address_bar = HOME_PAGE
 
+        # retained canvas state, see draw
+        self.drawn_tab = None
+        self.chrome = None
+        self.chrome_state = {}
+
         # wait for TK paint, then bind the event listeners
         self.window.wait_visibility(self.canvas)
         self.window.bind("<Down>", self.handle_down)
@@ -249,22 +693,22 @@ class Browser:
 
     def handle_down(self, e):
         self.tabs[self.active_tab].scrolldown()
-        self.draw()
+        self.frames.request_frame()
 
     def handle_up(self, e):
         self.tabs[self.active_tab].scrollup()
-        self.draw()
+        self.frames.request_frame()
 
     def handle_mousewheel(self, e):
         self.tabs[self.active_tab].mousewheel(e.delta)
-        self.draw()
+        self.frames.request_frame()
 
     def handle_click(self, e):
         self.focus = None
 
         if e.y < CHROME_HEIGHT:
             if 40 <= e.x < 40 + 80 * len(self.tabs) and 0 <= e.y < 40:
-                self.active_tab = int((e.x - 40) / 80)
+                self.activate_tab(int((e.x - 40) / 80))
             elif 10 <= e.x < 30 and 10 <= e.y < 30:
                 self.load(HOME_PAGE)
             elif 10 <= e.x < 35 and 40 <= e.y < 90:
@@ -274,7 +718,7 @@ class Browser:
         else:
             self.tabs[self.active_tab].click(e.x, e.y - CHROME_HEIGHT)
 
-        self.draw()
+        self.frames.request_frame()
 
     def handle_key(self, e):
         is_backspace = e.keysym == 'BackSpace'
@@ -292,87 +736,232 @@ class Browser:
                 self.address_bar = self.address_bar[0:-1]
             else:
                 self.address_bar += e.char
-            self.draw()
+            self.frames.request_frame()
 
     def handle_enter(self, e):
         if self.focus == "address bar":
             self.tabs[self.active_tab].load(self.address_bar)
             self.focus = None
-            self.draw()
+            self.frames.request_frame()
 
     def trigger_tab_render(self):
         """Tabs can use this function to trigger a draw"""
-        self.draw()
+        self.frames.request_frame()
+
+    def schedule_tab_task(self, task, delay_ms=None):
+        """Tabs can use this function to run work once the event loop is idle, or after a delay"""
+        if delay_ms is None:
+            self.window.after_idle(task)
+        else:
+            self.window.after(delay_ms, task)
 
     def resize(self, e):
         self.canvas.pack(fill='both', expand=1)
         self.width, self.height = e.width, e.height
-        self.tabs[self.active_tab].set_dimensions(self.width, self.height)
-        self.tabs[self.active_tab].build_and_paint_document()
-        self.draw()
+        # background tabs catch up when they're next activated
+        self.tabs[self.active_tab].materialize(self.width, self.height)
+        self.frames.request_frame()
+
+    def activate_tab(self, index: int):
+        self.active_tab = index
+        tab = self.tabs[index]
+        tab.last_active = next(self.activity)
+        # loads for tabs that can't be seen wait for those for the one that can
+        for other in self.tabs:
+            SCHEDULER.set_background(other, other is not tab)
+        tab.materialize(self.width, self.height)
+        self.enforce_memory_budget()
+
+    def enforce_memory_budget(self):
+        """Discards background tabs, least recently used first, until the estimated memory used
+        by all tabs fits the budget. Layouts go first, and DOMs too only if that isn't enough."""
+        active = self.tabs[self.active_tab]
+        background = sorted((tab for tab in self.tabs if tab is not active),
+                            key=lambda tab: tab.last_active)
+        usage = sum(tab.memory_usage() for tab in self.tabs)
+
+        for discard_dom in [False, True]:
+            for tab in background:
+                if usage <= self.tab_memory_budget:
+                    return
+                before = tab.memory_usage()
+                tab.discard(dom=discard_dom)
+                usage -= before - tab.memory_usage()
 
     def draw(self):
-        self.canvas.delete('all')
-        self.tabs[self.active_tab].draw(self.canvas)
+        with tracing.span("draw"):
+            tab = self.tabs[self.active_tab]
+            if self.drawn_tab is not tab:
+                tab.invalidate_canvas()
+                self.drawn_tab = tab
+
+            created_content = tab.draw(self.canvas)
+            self.draw_chrome()
+
+            if created_content:
+                # new content items are stacked on top, so put the chrome back above them
+                self.canvas.tag_raise(CHROME_TAG)
+
+        if self.show_trace_overlay:
+            self.draw_trace_overlay()
+
+    def draw_trace_overlay(self):
+        """Shows the latest time spent in each traced stage, and the counters, in the bottom right corner"""
+        trace = tracing.CURRENT
+        if not trace:
+            return
 
-        # fill in browser chrome
-        self.canvas.create_rectangle(
-            0, 0, self.width, CHROME_HEIGHT, fill="white", width=0)
+        with trace.lock:
+            # other threads may be adding to these
+            lines = [f"{name}: {duration * 1000:.1f}ms"
+                     for name, duration in trace.latest.items()]
+            lines.extend(f"{name}: {value}"
+                         for name, value in trace.counters.items())
+        frames = self.frames.stats.summary()
+        lines.append(f"frame p95: {frames['draw p95']:.1f}ms, "
+                     f"input latency p95: {frames['latency p95']:.1f}ms")
+        text = "\n".join(lines)
+
+        if self.trace_overlay is None:
+            self.trace_overlay = self.canvas.create_text(
+                0, 0, anchor="se", font=get_font(10, "normal", "roman"), fill="red")
+        self.canvas.coords(self.trace_overlay,
+                           self.width - 10, self.height - 10)
+        self.canvas.itemconfigure(self.trace_overlay, text=text)
+        self.canvas.tag_raise(self.trace_overlay)
+
+    def chrome_changed(self, key, value) -> bool:
+        """Records the value a piece of chrome was last drawn with, returning whether it changed"""
+        if self.chrome_state.get(key, None) == value:
+            return False
+        self.chrome_state[key] = value
+        return True
+
+    def create_chrome(self):
+        buttonfont = get_font(30, "normal", "roman")
+        self.chrome = {
+            "background": self.canvas.create_rectangle(
+                0, 0, self.width, CHROME_HEIGHT, fill="white", width=0, tags=CHROME_TAG),
+            # the new-tab button
+            "new_tab_box": self.canvas.create_rectangle(
+                10, 10, 30, 30, outline="black", width=1, tags=CHROME_TAG),
+            "new_tab_text": self.canvas.create_text(
+                11, 0, anchor="nw", text="+", font=buttonfont, fill="black", tags=CHROME_TAG),
+            # the address bar
+            "address_box": self.canvas.create_rectangle(
+                40, 50, self.width - 10, 90, outline="black", width=1, tags=CHROME_TAG),
+            "address_text": self.canvas.create_text(
+                55, 55, anchor='nw', text="", font=buttonfont, fill="black", tags=CHROME_TAG),
+            "address_cursor": self.canvas.create_line(
+                55, 55, 55, 85, fill="black", state="hidden", tags=CHROME_TAG),
+            # the back button
+            "back_box": self.canvas.create_rectangle(
+                10, 50, 35, 90, outline="black", width=1, tags=CHROME_TAG),
+            "back_arrow": self.canvas.create_polygon(
+                15, 70, 30, 55, 30, 85, fill='black', tags=CHROME_TAG),
+            "bottom_line": self.canvas.create_line(
+                0, CHROME_HEIGHT, self.width, CHROME_HEIGHT, fill="black", tags=CHROME_TAG),
+        }
+
+    def draw_chrome(self):
+        # chrome items are created once, then only the pieces whose inputs changed are updated
+        if self.chrome is None:
+            self.create_chrome()
+
+        if self.chrome_changed("width", self.width):
+            self.canvas.coords(
+                self.chrome["background"], 0, 0, self.width, CHROME_HEIGHT)
+            self.canvas.coords(
+                self.chrome["address_box"], 40, 50, self.width - 10, 90)
+            self.canvas.coords(
+                self.chrome["bottom_line"], 0, CHROME_HEIGHT, self.width, CHROME_HEIGHT)
+
+        if self.chrome_changed("tabs", (len(self.tabs), self.active_tab, self.width)):
+            self.draw_tab_strip()
+
+        if self.focus == "address bar":
+            text = self.address_bar
+        else:
+            text = self.tabs[self.active_tab].url
+
+        if self.chrome_changed("address_text", text):
+            self.canvas.itemconfigure(self.chrome["address_text"], text=text)
+
+        focused = self.focus == "address bar"
+        if self.chrome_changed("address_cursor", (focused, text)):
+            if focused:
+                w = get_font(30, "normal", "roman").measure(self.address_bar)
+                self.canvas.coords(
+                    self.chrome["address_cursor"], 55 + w, 55, 55 + w, 85)
+                self.canvas.itemconfigure(
+                    self.chrome["address_cursor"], state="normal")
+            else:
+                self.canvas.itemconfigure(
+                    self.chrome["address_cursor"], state="hidden")
+
+    def draw_tab_strip(self):
+        tags = (CHROME_TAG, TAB_STRIP_TAG)
+        self.canvas.delete(TAB_STRIP_TAG)
 
         tab_width, tab_height = 80, 40
         tabfont = get_font(20, "normal", "roman")
         for i, tab in enumerate(self.tabs):
             name = "Tab {}".format(i)
             x1, x2 = tab_height + tab_width * i, 120 + tab_width * i
-            self.canvas.create_line(x1, 0, x1, 40, fill="black")
-            self.canvas.create_line(x2, 0, x2, 40, fill="black")
+            self.canvas.create_line(x1, 0, x1, 40, fill="black", tags=tags)
+            self.canvas.create_line(x2, 0, x2, 40, fill="black", tags=tags)
             self.canvas.create_text(x1 + 10, 10, anchor="nw", text=name,
-                                    font=tabfont, fill="black")
+                                    font=tabfont, fill="black", tags=tags)
             if i == self.active_tab:
-                self.canvas.create_line(0, 40, x1, 40, fill="black")
-                self.canvas.create_line(x2, 40, self.width, 40, fill="black")
-
-        # draw the new-tab button
-        buttonfont = get_font(30, "normal", "roman")
-        self.canvas.create_rectangle(10, 10, 30, 30,
-                                     outline="black", width=1)
-        self.canvas.create_text(11, 0, anchor="nw", text="+",
-                                font=buttonfont, fill="black")
-
-        # draw the address bar
-        self.canvas.create_rectangle(40, 50, self.width - 10, 90,
-                                     outline="black", width=1)
-
-        if self.focus == "address bar":
-            self.canvas.create_text(
-                55, 55, anchor='nw', text=self.address_bar,
-                font=buttonfont, fill="black")
-            w = buttonfont.measure(self.address_bar)
-            self.canvas.create_line(55 + w, 55, 55 + w, 85, fill="black")
-        else:
-            url = self.tabs[self.active_tab].url
-            self.canvas.create_text(55, 55, anchor='nw', text=url,
-                                    font=buttonfont, fill="black")
-
-        # draw back button
-        self.canvas.create_rectangle(10, 50, 35, 90,
-                                     outline="black", width=1)
-        self.canvas.create_polygon(
-            15, 70, 30, 55, 30, 85, fill='black')
-
-        self.canvas.create_line(
-            0, CHROME_HEIGHT, self.width, CHROME_HEIGHT, fill="black")
+                self.canvas.create_line(
+                    0, 40, x1, 40, fill="black", tags=tags)
+                self.canvas.create_line(
+                    x2, 40, self.width, 40, fill="black", tags=tags)
 
     def load(self, url):
-        new_tab = Tab(self.width, self.height, self.trigger_tab_render)
+        new_tab = Tab(self.width, self.height, self.trigger_tab_render,
+                      self.schedule_tab_task, self.render_pool, self.bfcache,
+                      self.progressive_css, self.stylesheet_deadline_ms)
         new_tab.load(url)
-        self.active_tab = len(self.tabs)
         self.tabs.append(new_tab)
-        self.draw()
+        self.activate_tab(len(self.tabs) - 1)
+        self.frames.request_frame()
 
 
 if __name__ == '__main__':
-    import sys
-    initial_url = sys.argv[1] if len(sys.argv) < 1 else HOME_PAGE
-    Browser(800, 600).load(initial_url)
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("url", nargs="?", default=HOME_PAGE)
+    parser.add_argument("--render-workers", type=int, default=0,
+                        help="render pages in this many worker processes instead of the UI process")
+    parser.add_argument("--trace",
+                        help="record where time goes and write it to this file as Chrome trace events on exit")
+    parser.add_argument("--trace-overlay", action="store_true",
+                        help="record where time goes and show it on screen")
+    parser.add_argument("--frame-stats", action="store_true",
+                        help="print frame times and input latency on exit")
+    parser.add_argument("--progressive-css", action="store_true",
+                        help="paint pages before their linked stylesheets arrive, restyling as each does")
+    parser.add_argument("--stylesheet-deadline", type=int, metavar="MS",
+                        help="with --progressive-css, drop stylesheets that take longer than this to arrive")
+    args = parser.parse_args()
+
+    render_pool = None
+    if args.render_workers:
+        from render import RenderPool
+        render_pool = RenderPool(args.render_workers)
+
+    if args.trace or args.trace_overlay:
+        tracing.start()
+
+    browser = Browser(800, 600, render_pool, args.trace_overlay,
+                      args.progressive_css, args.stylesheet_deadline)
+    browser.load(args.url)
     tkinter.mainloop()
+
+    if args.trace:
+        tracing.stop().export(args.trace)
+
+    if args.frame_stats:
+        for name, value in browser.frames.stats.summary().items():
+            print(f"{name:<20}{value:>10.1f}")
@@ -1,32 +1,215 @@
-from os.path import join
-from os import stat
-from time import time
+"""The HTTP cache, shared by every browser and render worker process.
+
+Entries are written to a temporary file and renamed into place, so readers in any
+process see a whole entry or none of it, never a torn one, even if the writer crashes
+part way through. Each entry starts with the time it expires, rather than relying on
+file timestamps. An index of the entries and when they expire lets expired ones be
+cleaned up. It's updated under an advisory lock, since several processes may be
+writing at once.
+
+Writes happen on a background thread (write-behind), so loading a page never waits
+on the disk. Entries still waiting to be written are served from memory.
+"""
+import atexit
+import hashlib
+import os
+import queue
+import tempfile
+import threading
+from contextlib import contextmanager
+from os import fdopen, fsync, makedirs, replace, unlink
+from os.path import dirname, join
+from time import monotonic, time
+
+try:
+    import fcntl
+except ImportError:
+    # no advisory locks (e.g. on Windows), so only one process should use the cache at a time
+    fcntl = None
 
 CACHE_DIR = './cache'
+INDEX_PATH = join(CACHE_DIR, "index")
+LOCK_PATH = join(CACHE_DIR, "index.lock")
+
+# responses waiting to be written, as url: (expiry time or None, response)
+PENDING = {}
+PENDING_LOCK = threading.Lock()
+
+# functions doing disk writes, run in order on the writer thread
+WRITES = queue.Queue()
+WRITER = None
+WRITER_LOCK = threading.Lock()
+# longest flush waits for queued writes, so exiting never hangs on a slow or stuck disk
+FLUSH_TIMEOUT = 10
+
+
+def atomic_write(path: str, data: bytes):
+    """Writes data to path so that readers see either the old contents or the new, never part of either"""
+    fd, temp_path = tempfile.mkstemp(dir=dirname(path), prefix=".tmp-")
+    try:
+        with fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            fsync(f.fileno())
+        replace(temp_path, path)
+    except BaseException:
+        unlink(temp_path)
+        raise
+
+
+def write_behind(write):
+    """Runs write() on the writer thread, after any writes queued before it"""
+    global WRITER
+    with WRITER_LOCK:
+        if WRITER is None:
+            WRITER = threading.Thread(target=run_writes, name="cache writer", daemon=True)
+            WRITER.start()
+            # the writer is a daemon thread, so finish its queue before exiting
+            atexit.register(flush)
+    WRITES.put(write)
+
+
+def run_writes():
+    while True:
+        write = WRITES.get()
+        try:
+            write()
+        except Exception:
+            # caching is best effort, the response just gets fetched again.
+            # the writer has to outlive any one bad write, or flush would wait forever.
+            pass
+        finally:
+            WRITES.task_done()
+
+
+def flush(timeout: float = FLUSH_TIMEOUT):
+    """Waits for queued writes to finish, for up to timeout seconds"""
+    deadline = monotonic() + timeout
+    with WRITES.all_tasks_done:
+        while WRITES.unfinished_tasks:
+            remaining = deadline - monotonic()
+            if remaining <= 0 or WRITER is None or not WRITER.is_alive():
+                # whatever's left is fetched again next time
+                return
+            WRITES.all_tasks_done.wait(min(remaining, 0.1))
+
+
+def reset_after_fork():
+    # a forked process doesn't get the writer thread, and the locks may have been held
+    # when it forked. the writes queued so far are left to the parent.
+    global PENDING_LOCK, WRITES, WRITER, WRITER_LOCK
+    PENDING.clear()
+    PENDING_LOCK = threading.Lock()
+    WRITES = queue.Queue()
+    WRITER = None
+    WRITER_LOCK = threading.Lock()
+
+
+# there's no fork on Windows
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_after_fork)
+
+
+def entry_path(url: str) -> str:
+    return join(CACHE_DIR, hashlib.sha1(url.encode("utf-8")).hexdigest())
+
+
+def read_entry(path: str):
+    """Returns the expiry time (None for never) and response stored at path"""
+    with open(path, "rb") as file:
+        contents = file.read()
+    expires_directive, response = contents.split(b'\n', 1)
+    name, expires = expires_directive.decode('UTF-8').split('=')
+    if name != "expires":
+        raise ValueError("not a cache entry")
+    return None if expires == "never" else float(expires), response
+
+
+def expired(expires) -> bool:
+    return expires is not None and expires <= time()
+
+
+@contextmanager
+def index_lock():
+    with open(LOCK_PATH, "a") as lock:
+        if fcntl:
+            # released when the file is closed
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def read_index() -> dict:
+    """Maps the URL of each entry to when it expires"""
+    index = {}
+    try:
+        with open(INDEX_PATH) as f:
+            for line in f:
+                if "\t" not in line:
+                    # not written by update_index, e.g. a URL with a newline in it
+                    continue
+                expires, url = line.rstrip("\n").split("\t", 1)
+                index[url] = None if expires == "never" else float(expires)
+    except FileNotFoundError:
+        pass
+    return index
+
+
+def update_index(url: str, expires):
+    """Records the entry for url, and deletes entries that have expired"""
+    with index_lock():
+        index = read_index()
+        index[url] = expires
+
+        for entry_url, entry_expires in list(index.items()):
+            if not expired(entry_expires):
+                continue
+            path = entry_path(entry_url)
+            try:
+                # another process may have stored a fresh entry since the index was written
+                if expired(read_entry(path)[0]):
+                    unlink(path)
+            except (OSError, ValueError):
+                pass
+            del index[entry_url]
+
+        atomic_write(INDEX_PATH, "".join(
+            f"{'never' if expires is None else expires}\t{url}\n"
+            for url, expires in index.items()).encode("utf-8"))
 
 
 class Cache():
     @staticmethod
     def cache(url: str, response: bytes, max_age: int = "none"):
-        with open(join("cache", url.replace('/', '_')), 'wb') as file:
-            file.write(bytes(f"max_age={max_age}\n",
-                       encoding="UTF-8") + response)
+        expires = None if max_age == "none" else time() + int(max_age)
+        with PENDING_LOCK:
+            PENDING[url] = (expires, response)
+        write_behind(lambda: Cache.store(url, expires, response))
 
     @staticmethod
-    def retrieve(url: str) -> bytes:
+    def store(url: str, expires, response: bytes):
         try:
-            with open(join("cache", url.replace('/', '_')), 'rb') as file:
-                contents = file.read()
-                max_age_directive, cached_response = contents.split(b'\n', 1)
-                _, max_age = max_age_directive.decode('UTF-8').split('=')
-                cache_fresh = True
-                if max_age != "none":
-                    # if a user manually edits the metadata for a file in the cache on unix systems, st_ctime won't be accurate
-                    # see https://docs.python.org/3/library/stat.html#stat.ST_CTIME for more info
-                    modified_time = stat(file.fileno()).st_ctime
-                    current_time = int(time())
-                    cache_fresh = (current_time - modified_time) < int(max_age)
-
-                return cached_response if cache_fresh else None
-        except FileNotFoundError:
-            return None
+            makedirs(CACHE_DIR, exist_ok=True)
+            header = f"expires={'never' if expires is None else expires}\n"
+            atomic_write(entry_path(url), header.encode("UTF-8") + response)
+            update_index(url, expires)
+        finally:
+            with PENDING_LOCK:
+                # unless it's been cached again since
+                if PENDING.get(url, (None, None))[1] is response:
+                    del PENDING[url]
+
+    @staticmethod
+    def retrieve(url: str) -> bytes:
+        with PENDING_LOCK:
+            pending = PENDING.get(url)
+
+        if pending:
+            expires, cached_response = pending
+        else:
+            try:
+                expires, cached_response = read_entry(entry_path(url))
+            except (FileNotFoundError, ValueError):
+                # not cached, or cached by an older version in another format
+                return None
+
+        return None if expired(expires) else cached_response
@@ -1,8 +1,13 @@
+import re
+from functools import lru_cache
+from sys import intern
 from typing import List
 from dom import Element
 
 
 class TagSelector:
+    __slots__ = ("tag", "priority")
+
     def __init__(self, tag: str):
         self.tag = tag
         self.priority = 1
@@ -15,6 +20,8 @@ class TagSelector:
 
 
 class DescendantSelector:
+    __slots__ = ("ancestor", "descendant", "priority")
+
     def __init__(self, ancestor, descendant: TagSelector):
         self.ancestor = ancestor
         self.descendant = descendant
@@ -40,97 +47,385 @@ class DescendantSelector:
         return False
 
 
+class FontSize:
+    """A compiled font-size value, either in pixels or relative to the parent's font size"""
+    __slots__ = ("amount", "relative")
+
+    def __init__(self, amount: float, relative: bool):
+        self.amount = amount
+        self.relative = relative
+
+    def __repr__(self):
+        return f"{self.amount * 100}%" if self.relative else f"{self.amount}px"
+
+    def resolve(self, parent_px: float) -> float:
+        return self.amount * parent_px if self.relative else self.amount
+
+
+def compile_value(prop: str, value: str):
+    """Converts a declaration's value to the typed form the cascade uses, or None if it isn't supported.
+    Doing this once at parse time means the cascade only has to do arithmetic."""
+    if prop == "font-size":
+        try:
+            if value.endswith("px"):
+                return FontSize(float(value[:-2]), False)
+            elif value.endswith("%"):
+                return FontSize(float(value[:-1]) / 100, True)
+        except ValueError:
+            pass
+        return None
+    else:
+        # the remaining properties are keywords and colors, which are used as is
+        return intern(value)
+
+
+# a run of the characters selectors, properties and values are made of
+WORD = r"[\w#\-.%]+"
+STRING = r"""(?:"(?:[^"\\\n]|\\[\s\S])*"|'(?:[^'\\\n]|\\[\s\S])*')"""
+
+# everything up to the next } outside of a string
+UNTIL_CLOSE = r"""(?:[^}"']+|""" + STRING + r"""|["'])*"""
+# either a rule, a rule with a bad selector to be skipped, or else the whitespace before an
+# at-rule or the end. closing braces are optional here (and checked for after) to avoid backtracking.
+RULES = re.compile(
+    r"\s*(?:(" + WORD + r"(?:\s+" + WORD + r")*)\s*\{(" + UNTIL_CLOSE + r")(\}?)|(?![\s@])" + UNTIL_CLOSE + r"(\}?))|\s*")
+# a character that can't be in a selector, which is just words (tags) and the whitespace between them
+NOT_IN_SELECTOR = re.compile(r"[^\w#\-.%\s]")
+# up to the ; or { that ends an at-rule's prelude
+AT_RULE_PRELUDE = re.compile(r"""(?:[^{};"']+|""" + STRING + r"""|["'])*([{;]?)""")
+NEXT_BRACE = re.compile(r"""(?:[^{}"']+|""" + STRING + r"""|["'])*([{}]?)""")
+BODY = re.compile(UNTIL_CLOSE)
+WHITESPACE = re.compile(r"\s*")
+STRINGS = re.compile(STRING)
+# a declaration's property and the first word of its value
+DECLARATION = re.compile(r"\s*(" + WORD + r")\s*:\s*(" + WORD + r")")
+
+# selectors, as written, to what they parse to (None for ones that can't be parsed),
+# and declaration blocks to their compiled bodies. both repeat a lot within a style sheet
+# and between them, and what they parse to is shared and never modified. style sheets are parsed
+# on several threads at once, any of which may empty a cache, so each lookup is a single get.
+SELECTORS = {}
+# what SELECTORS.get gives back for selectors that haven't been parsed yet
+UNPARSED = object()
+MAX_CACHED_SELECTORS = 4096
+DECLARATION_BLOCKS = {}
+MAX_CACHED_DECLARATION_BLOCKS = 4096
+# declarations, as written, to their compiled (property, value) pair, or () if they're unsupported
+DECLARATIONS = {}
+MAX_CACHED_DECLARATIONS = 4096
+
+
+def strip_comments(s: str) -> str:
+    start = s.find("/*")
+    if start == -1:
+        return s
+
+    # str.find rather than a regular expression, since it's a plain scan for the next marker
+    pieces = []
+    end = 0
+    while start != -1:
+        pieces.append(s[end:start])
+        end = s.find("*/", start + 2)
+        if end == -1:
+            # an unclosed comment runs to the end
+            end = len(s)
+            break
+        end += 2
+        start = s.find("/*", end)
+    pieces.append(s[end:])
+    return " ".join(pieces)
+
+
 class CSSParser:
+    """Parses style sheets a whole run of rules at a time.
+
+    Rules and declarations that can't be parsed are skipped: a bad selector skips the
+    whole rule, up to the next }, and a bad declaration skips up to the next ; or the end
+    of the rule. Only the first word of a value is kept. Comments, strings and at-rules
+    (along with any block they have) are skipped over.
+
+    Outside of strings a rule ends at the next }, so the style sheet is split apart at each }
+    with str.split. Unless a string in it might have a brace or ; in it (see strings_matter),
+    every piece up to the next at-rule is a rule. Otherwise pieces with strings in them are
+    checked with plain first, and those that aren't plain are parsed with RULES. Selectors and
+    declaration blocks are then compiled all at once, see compile_rules.
+    """
+
     def __init__(self, s: str):
-        self.s = s
+        self.s = strip_comments(s)
         self.i = 0
 
-    def whitespace(self):
-        while self.i < len(self.s) and self.s[self.i].isspace():
-            self.i += 1
+    def body(self):
+        """Parses declarations up to the end of the rule (or of the string, for inline styles)"""
+        end = BODY.match(self.s, self.i).end()
+        pairs = parse_declarations(self.s[self.i:end])
+        self.i = end
+        return pairs
+
+    def skip_at_rule(self):
+        """Skips an at-rule, either up to its ; or past its block"""
+        s = self.s
+        match = AT_RULE_PRELUDE.match(s, self.i)
+        self.i = match.end() + 1
+        if match.group(1) != "{":
+            return
+
+        depth = 1
+        i = self.i
+        find, rfind = s.find, s.rfind
+        while depth:
+            close = find("}", i)
+            if close == -1:
+                # never closed, so it runs to the end
+                i = len(s)
+                break
+            first_quote = min((q for q in (find('"', i, close), find("'", i, close)) if q != -1), default=len(s))
+            if first_quote > close or (rfind("{", i, close) < first_quote and
+                                       not string_runs_to(s, max(rfind('"', i, close), rfind("'", i, close)), close)):
+                # every { up to here opens a block (none are in strings) and the } closes one
+                depth += s.count("{", i, close) - 1
+                i = close + 1
+                continue
 
-    def word(self):
-        beginning = self.i
-        while self.i < len(self.s):
-            if self.s[self.i].isalnum() or self.s[self.i] in "#-.%":
-                self.i += 1
+            match = NEXT_BRACE.match(s, i)
+            i = match.end()
+            if match.group(1) == "{":
+                depth += 1
+            elif match.group(1) == "}":
+                depth -= 1
             else:
                 break
+        self.i = i
 
-        assert self.i > beginning
-        return self.s[beginning:self.i]
+    def parse(self) -> List[tuple[TagSelector | DescendantSelector, dict]]:
+        # the selector, {, and declaration block of each rule, as written (and as str.partition gives them)
+        found = []
+        s = self.s
+        quoted = strings_matter(s)
+        # outside of strings, each rule ends at the next }. the last piece is what's after the last }.
+        pieces = s.split("}")
+        last = len(pieces) - 1
+        k = 0
+        # where pieces[k] starts
+        start = 0
+        while True:
+            if k < last and not quoted:
+                # every piece up to the next at-rule is a rule, or if it has no { one to skip
+                at = s.find("@", start)
+                n = last - k if at == -1 else s.count("}", start, at)
+                if n:
+                    found += [piece.partition("{") for piece in pieces[k:k + n]]
+                    start = s.rfind("}", start, len(s) if at == -1 else at) + 1
+                    k += n
+                    continue
 
-    def literal(self, literal: str):
-        assert self.i < len(
-            self.s) and self.s[self.i] == literal, f'literal didn\'t match: {literal}'
-        self.i += 1
+            if k < last:
+                piece = pieces[k]
+                head, brace, body = piece.partition("{")
+                if not quoted or plain(s, start, piece, head):
+                    if "@" not in head or not head.lstrip().startswith("@"):
+                        found.append((head, brace, body))
+                        start += len(piece) + 1
+                        k += 1
+                        continue
 
-    def pair(self):
-        prop = self.word()
-        self.whitespace()
-        self.literal(':')
-        self.whitespace()
-        value = self.word()
+                    # an at-rule's block is skipped by counting braces, as long as none are in strings
+                    if brace and ";" not in head:
+                        depth = 0
+                        end, j = start, k
+                        while j < last and (not quoted or plain(s, end, pieces[j], "", True)):
+                            depth += pieces[j].count("{") - 1
+                            end += len(pieces[j]) + 1
+                            j += 1
+                            if depth <= 0:
+                                break
+                        if depth <= 0 < j - k:
+                            start, k = end, j
+                            continue
 
-        return prop.lower(), value
+            # an at-rule, a rule with a } in a string, or the end, which need more care
+            i = self.parse_carefully(start, found)
+            if i is None:
+                break
+            while k < last and start + len(pieces[k]) < i:
+                start += len(pieces[k]) + 1
+                k += 1
+            if i > start:
+                # part way through a piece, e.g. after an at-rule ending in a ;
+                pieces[k] = s[i:start + len(pieces[k])]
+                start = i
 
-    def body(self):
-        pairs = {}
-        while self.i < len(self.s) and self.s[self.i] != "}":
-            try:
-                prop, value = self.pair()
-                pairs[prop] = value
-                self.whitespace()
-                self.literal(';')
-                self.whitespace()
-            except AssertionError:
-                why = self.ignore_until([";", "}"])
-                if why == ";":
-                    self.literal(";")
-                    self.whitespace()
-                else:
-                    break
+        return compile_rules(found, quoted)
 
-        return pairs
+    def parse_carefully(self, i: int, found: list) -> int | None:
+        """Parses the rule or at-rule at i with RULES, returning where the next one starts,
+        or None if there aren't any more"""
+        s = self.s
+        match = RULES.match(s, i)
+        selector_text, body, closed, skipped = match.groups()
+        if closed:
+            found.append((selector_text, "{", body))
+            return match.end()
+        elif skipped:
+            return match.end()
+
+        # an at-rule, the end, or a rule that's never closed
+        self.i = WHITESPACE.match(s, i).end()
+        if self.i < len(s) and s[self.i] == "@":
+            self.skip_at_rule()
+            return self.i
+        return None
 
-    def ignore_until(self, chars: List[str]):
-        while self.i < len(self.s):
-            if self.s[self.i] not in chars:
-                self.i += 1
-            else:
-                return self.s[self.i]
 
-    def selector(self):
-        out = TagSelector(self.word().lower())
-        self.whitespace()
-        while self.i < len(self.s) and self.s[self.i] != '{':
-            tag = self.word()
-            descendant = TagSelector(tag.lower())
-            out = DescendantSelector(out, descendant)
-            self.whitespace()
+def strings_matter(s: str) -> bool:
+    """Whether s might have a string in it with a {, } or ; in it (or that isn't closed). If not,
+    strings don't need telling apart from the rest, as none of them change where anything ends."""
+    if "'" in s:
+        if '"' in s:
+            # one kind of quote may be in a string of the other kind
+            return True
+        quote = "'"
+    elif '"' in s:
+        quote = '"'
+    else:
+        return False
 
-        return out
+    # with just the one kind of quote, and no escapes or line breaks in between, each pair is a string
+    parts = s.split(quote)
+    if len(parts) % 2 == 0:
+        return True
+    inside = "".join(parts[1::2])
+    return "{" in inside or "}" in inside or ";" in inside or "\\" in inside or "\n" in inside
 
-    def parse(self) -> List[tuple[TagSelector | DescendantSelector, dict]]:
-        rules = []
-        while self.i < len(self.s):
-            try:
-                self.whitespace()
-                selector = self.selector()
-                self.literal("{")
-                self.whitespace()
-                body = self.body()
-                self.literal("}")
-                rules.append((selector, body))
-            except AssertionError:
-                why = self.ignore_until(["}"])
-                if why == '}':
-                    self.literal('}')
-                    self.whitespace()
-                else:
-                    break
-
-        return rules
+
+def plain(s: str, start: int, piece: str, head: str, in_block=False) -> bool:
+    """Whether the piece of s at start (with head before its first {) really ends at the } after it,
+    rather than that } being in a string. In a block (in_block), its {s mustn't be in strings either."""
+    if '"' not in piece and "'" not in piece:
+        return True
+    elif '"' in head or "'" in head:
+        # the selector is bad, and skipping it is left to RULES
+        return False
+
+    end = start + len(piece)
+    last_quote = max(s.rfind('"', start, end), s.rfind("'", start, end))
+    if in_block:
+        first_quote = min(q for q in (s.find('"', start, end), s.find("'", start, end)) if q != -1)
+        if s.rfind("{", start, end) > first_quote:
+            return False
+        return not string_runs_to(s, last_quote, end)
+    return not string_runs_to(s, last_quote, end) or BODY.match(s, start + len(head) + 1).end() == end
+
+
+def string_runs_to(s: str, last_quote: int, end: int) -> bool:
+    """Whether a string might run past end, given the last quote before it. If one did, everything
+    after that quote would be in it, but strings can't have newlines in them unless they're escaped."""
+    newline = s.find("\n", last_quote, end)
+    return newline == -1 or s[newline - 1] == "\\"
+
+
+def compile_rules(found: List[tuple[str, str, str]], quoted=True) -> List[tuple[TagSelector | DescendantSelector, dict]]:
+    """Parses the selector and compiles the declarations of each rule, given as written.
+    Rules without a block, or whose selector isn't supported, are left out. Unless quoted, no string has a ; in it."""
+    # the caches are emptied when they're full, rather than part way through a style sheet
+    if len(SELECTORS) >= MAX_CACHED_SELECTORS:
+        SELECTORS.clear()
+    if len(DECLARATION_BLOCKS) >= MAX_CACHED_DECLARATION_BLOCKS:
+        DECLARATION_BLOCKS.clear()
+
+    selectors, blocks = SELECTORS, DECLARATION_BLOCKS
+    rules = []
+    for selector_text, brace, block in found:
+        if not brace:
+            continue
+        selector = selectors.get(selector_text, UNPARSED)
+        if selector is UNPARSED:
+            selector = parse_selector(selector_text)
+        if selector is not None:
+            body = blocks.get(block)
+            if body is None:
+                body = compile_declaration_block(block, quoted)
+            rules.append((selector, body))
+    return rules
+
+
+def parse_selector(text: str) -> TagSelector | DescendantSelector | None:
+    """Parses (and caches) a selector as written, or returns None if it isn't supported"""
+    # one lookup, since another thread may empty the cache in between two (see compile_rules)
+    selector = SELECTORS.get(text, UNPARSED)
+    if selector is not UNPARSED:
+        return selector
+
+    selector = None
+    if NOT_IN_SELECTOR.search(text) is None:
+        # selectors share the selector for each tag in them, cached under the tag
+        for tag in text.lower().split():
+            tag_selector = SELECTORS.get(tag)
+            if tag_selector is None:
+                tag_selector = SELECTORS[tag] = TagSelector(tag)
+            selector = tag_selector if selector is None else DescendantSelector(selector, tag_selector)
+
+    SELECTORS[text] = selector
+    return selector
+
+
+def compile_declaration_block(block: str, quoted=True) -> dict:
+    """Compiles (and caches) a declaration block. Unless quoted, no string in it has a ; in it."""
+    text = block
+    if quoted and ('"' in text or "'" in text):
+        # strings can have ; in them, but are never a property or the first word of a value
+        text = STRINGS.sub("\0", text)
+
+    declarations = DECLARATIONS
+    body = {}
+    for declaration in text.split(";"):
+        # declarations repeat a lot more than whole blocks do
+        compiled = declarations.get(declaration)
+        if compiled is None:
+            if len(declarations) >= MAX_CACHED_DECLARATIONS:
+                declarations.clear()
+            compiled = declarations[declaration] = compile_declaration(declaration)
+        if compiled:
+            body[compiled[0]] = compiled[1]
+
+    DECLARATION_BLOCKS[block] = body
+    return body
+
+
+def compile_declaration(declaration: str) -> tuple:
+    """The (property, compiled value) pair for a declaration, or () if it's unsupported"""
+    match = DECLARATION.match(declaration)
+    if not match:
+        return ()
+    prop, value = match.groups()
+    prop = intern(prop.lower())
+    value = compile_value(prop, value)
+    return () if value is None else (prop, value)
+
+
+def parse_declarations(text: str) -> dict:
+    """Compiles a declaration block. The returned body is shared and must not be modified."""
+    body = DECLARATION_BLOCKS.get(text)
+    if body is None:
+        if len(DECLARATION_BLOCKS) >= MAX_CACHED_DECLARATION_BLOCKS:
+            DECLARATION_BLOCKS.clear()
+        body = compile_declaration_block(text)
+    return body
+
+
+@lru_cache(maxsize=1024)
+def parse_inline_style(style: str) -> dict:
+    """Parses a style attribute. Pages tend to repeat the same few inline styles, so these are cached.
+    The returned body is shared and must not be modified."""
+    return CSSParser(style).body()
+
+
+def clear_caches():
+    """Forgets every parsed selector and declaration block, e.g. to time parsing from cold"""
+    SELECTORS.clear()
+    DECLARATION_BLOCKS.clear()
+    DECLARATIONS.clear()
+    parse_inline_style.cache_clear()
 
 
 def print_rules(rules: List[tuple[TagSelector | DescendantSelector, dict]]):
@@ -1,4 +1,5 @@
 
+from sys import intern
 from typing import List
 from entities import entity_to_chars_dict
 from request import request_url
@@ -8,7 +9,13 @@ def only_body(root):
     return root.children[1]
 
 
+# shared by all Text nodes rather than giving each one its own empty list
+NO_CHILDREN = ()
+
+
 class Element:
+    __slots__ = ("tag", "attributes", "children", "parent", "style")
+
     def __init__(self, tag: str, attributes: dict, parent):
         self.tag = tag
         self.attributes = attributes
@@ -20,11 +27,13 @@ class Element:
 
 
 class Text:
+    __slots__ = ("text", "children", "parent", "style")
+
     def __init__(self, text: str, parent: Element):
         for entity in entity_to_chars_dict:
             text = text.replace(entity, entity_to_chars_dict[entity])
         self.text = text
-        self.children = []
+        self.children = NO_CHILDREN
         self.parent = parent
 
     def __repr__(self):
@@ -32,48 +41,55 @@ class Text:
 
 
 class HTMLParser:
-    HEAD_TAGS = [
+    HEAD_TAGS = frozenset([
         "base", "basefont", "bgsound", "noscript",
         "link", "meta", "title", "style", "script",
-    ]
-    SELF_CLOSING_TAGS = [
+    ])
+    SELF_CLOSING_TAGS = frozenset([
         "area", "base", "br", "col", "embed", "hr", "img", "input",
         "link", "meta", "param", "source", "track", "wbr",
-    ]
+    ])
+    # tags that don't imply a head or body when directly inside <html>
+    HTML_CHILD_TAGS = frozenset(["head", "body", "/html"])
+    # tags that don't imply the end of the head
+    IN_HEAD_TAGS = HEAD_TAGS | {"/head"}
 
     def __init__(self, html):
         self.html = html
         self.unfinished = []
 
     def implicit_tags(self, tag: str):
+        # the outermost open tag is always html, so the insertion mode only depends on how many
+        # tags are open and, with two open, whether the second is head. this keeps each token O(1)
+        # rather than O(depth).
         while True:
-            open_tags = [node.tag for node in self.unfinished]
-            if open_tags == [] and tag != "html":
+            depth = len(self.unfinished)
+            if depth == 0 and tag != "html":
                 self.add_tag("html")
-            elif open_tags == ["html"] \
-                    and tag not in ["head", "body", "/html"]:
+            elif depth == 1 and tag not in self.HTML_CHILD_TAGS:
                 if tag in self.HEAD_TAGS:
                     self.add_tag("head")
                 else:
                     self.add_tag("body")
-            elif open_tags == ["html", "head"] and \
-                    tag not in ["/head"] + self.HEAD_TAGS:
+            elif depth == 2 and self.unfinished[1].tag == "head" \
+                    and tag not in self.IN_HEAD_TAGS:
                 self.add_tag("/head")
             else:
                 break
 
     def get_attributes(self, text):
         parts = text.split()
-        tag = parts[0].lower()
+        # tag and attribute names repeat constantly, so only keep one copy of each
+        tag = intern(parts[0].lower())
         attributes = {}
         for attrpair in parts[1:]:
             if "=" in attrpair:
                 key, value = attrpair.split("=", 1)
                 if len(value) > 2 and value[0] in ["'", "\""]:
                     value = value[1:-1]
-                attributes[key.lower()] = value
+                attributes[intern(key.lower())] = value
             else:
-                attributes[attrpair.lower()] = ""
+                attributes[intern(attrpair.lower())] = ""
         return tag, attributes
 
     def parse(self):
@@ -133,10 +149,28 @@ class HTMLParser:
         return self.unfinished.pop()
 
 
+def walk_tree(root):
+    """Yields every node under root (inclusive) in document order.
+    Uses an explicit stack rather than recursion, so deeply nested trees can't overflow it."""
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(reversed(node.children))
+
+
+def walk_tree_with_depth(root):
+    """Like walk_tree, but yields (node, depth) pairs where root has depth 0"""
+    stack = [(root, 0)]
+    while stack:
+        node, depth = stack.pop()
+        yield node, depth
+        stack.extend((child, depth + 1) for child in reversed(node.children))
+
+
 def print_tree(node, indent=0):
-    print(" " * indent, node)
-    for child in node.children:
-        print_tree(child, indent + 2)
+    for descendant, depth in walk_tree_with_depth(node):
+        print(" " * (indent + 2 * depth), descendant)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,211 @@
+"""Keeps parsed DOMs on disk, so reloading a page that hasn't changed skips HTML parsing.
+
+The parser looks at every character of the page in Python, which dominates loading big
+documents. After parsing one, its DOM is saved as a snapshot, keyed by its URL and the
+response's cache validator (its ETag or Last-Modified header, or the modification time
+and size of a local file). While the validator stays the same the page is the same, so
+its DOM is rebuilt from the snapshot rather than parsed again.
+
+Snapshots are compact binary: the nodes in document order as flat arrays of tag ids and
+parent indices, with all text and attribute values in one string indexed by offsets, and
+the tag and attribute names in another, each preceded in an array by its length.
+Styles aren't part of a snapshot, since they depend on the stylesheets too.
+
+Snapshots take up at most MAX_SNAPSHOT_BYTES on disk between them. Past that, the least
+recently used are deleted, going by modification times, which are updated on each load.
+"""
+import hashlib
+import struct
+import sys
+from array import array
+from os import makedirs, scandir, stat, unlink, utime
+from os.path import join
+from sys import intern
+
+import tracing
+from cache import CACHE_DIR, atomic_write, write_behind
+from dom import NO_CHILDREN, Element, Text, walk_tree
+
+SNAPSHOT_DIR = join(CACHE_DIR, "dom")
+# the version of the format, and the byte order the arrays were written in
+MAGIC = b"DOM2" + sys.byteorder[0].encode()
+# parsing small pages is quick enough that snapshots aren't worth the disk space
+MIN_SNAPSHOT_LENGTH = 10_000
+# beyond this, the least recently used snapshots are deleted
+MAX_SNAPSHOT_BYTES = 256 * 1024 * 1024
+# tag id of text nodes, element tags are numbered from 1
+TEXT = 0
+
+# set to False to always parse, e.g. when timing the parser
+ENABLED = True
+
+
+def snapshot_validator(url: str, headers: dict):
+    """What identifies this version of the page at url, or None if nothing does"""
+    url, _, _ = url.partition("#")
+    if url.startswith("file://"):
+        info = stat(url[len("file://"):])
+        return f"{info.st_mtime_ns}-{info.st_size}"
+    return headers.get("etag") or headers.get("last-modified")
+
+
+def serialize_dom(root) -> bytes:
+    names = {}
+    tags = array("I")
+    parents = array("i")
+    # the number of attributes on each element, then each attribute's name
+    attribute_counts = array("I")
+    attribute_names = array("I")
+    strings = []
+    offsets = array("I", [0])
+
+    index = {}
+    for i, node in enumerate(walk_tree(root)):
+        index[id(node)] = i
+        parents.append(index[id(node.parent)] if node.parent else -1)
+
+        if isinstance(node, Text):
+            tags.append(TEXT)
+            strings.append(node.text)
+            offsets.append(offsets[-1] + len(node.text))
+            continue
+
+        tags.append(names.setdefault(node.tag, len(names) + 1))
+        attribute_counts.append(len(node.attributes))
+        for name, value in node.attributes.items():
+            attribute_names.append(names.setdefault(name, len(names) + 1))
+            strings.append(value)
+            offsets.append(offsets[-1] + len(value))
+
+    # names are stored by length rather than with a separator, since any character could be in one
+    encoded_names = [name.encode("utf-8", "surrogatepass") for name in names]
+    name_lengths = array("I", map(len, encoded_names))
+    arrays = [name_lengths, tags, parents, attribute_counts, attribute_names, offsets]
+    blobs = [b"".join(encoded_names),
+             "".join(strings).encode("utf-8", "surrogatepass")] + \
+        [values.tobytes() for values in arrays]
+    return MAGIC + struct.pack(f"!{len(blobs)}I", *map(len, blobs)) + b"".join(blobs)
+
+
+def deserialize_dom(data: bytes):
+    if not data.startswith(MAGIC):
+        raise ValueError("not a DOM snapshot in this format")
+
+    pos = len(MAGIC)
+    lengths = struct.unpack_from("!8I", data, pos)
+    pos += struct.calcsize("!8I")
+    blobs = []
+    for length in lengths:
+        blobs.append(data[pos:pos + length])
+        pos += length
+    if pos != len(data):
+        raise ValueError("truncated DOM snapshot")
+
+    names_blob, strings_blob = blobs[:2]
+    strings = strings_blob.decode("utf-8", "surrogatepass")
+    name_lengths, tags, parents, attribute_counts, attribute_names, offsets = [
+        array(typecode, blob) for typecode, blob in zip("IIiIII", blobs[2:])]
+
+    names = [None]
+    start = 0
+    for length in name_lengths:
+        names.append(intern(names_blob[start:start + length].decode("utf-8", "surrogatepass")))
+        start += length
+
+    nodes = []
+    element = 0
+    attribute = 0
+    string = 0
+    for tag, parent_index in zip(tags, parents):
+        parent = nodes[parent_index] if parent_index >= 0 else None
+
+        # bypass the constructors, which would expand entities that already have been
+        if tag == TEXT:
+            node = Text.__new__(Text)
+            node.text = strings[offsets[string]:offsets[string + 1]]
+            node.children = NO_CHILDREN
+            string += 1
+        else:
+            node = Element.__new__(Element)
+            node.tag = names[tag]
+            node.attributes = {}
+            for _ in range(attribute_counts[element]):
+                node.attributes[names[attribute_names[attribute]]] = \
+                    strings[offsets[string]:offsets[string + 1]]
+                attribute += 1
+                string += 1
+            node.children = []
+            element += 1
+
+        node.parent = parent
+        if parent is not None:
+            parent.children.append(node)
+        nodes.append(node)
+
+    return nodes[0]
+
+
+def snapshot_path(url: str) -> str:
+    # fragments don't change the page
+    url, _, _ = url.partition("#")
+    return join(SNAPSHOT_DIR, hashlib.sha1(url.encode("utf-8")).hexdigest())
+
+
+def load_snapshot(url: str, validator: str):
+    """The DOM saved for this version of the page at url, if there is one"""
+    path = snapshot_path(url)
+    try:
+        with open(path, "rb") as f:
+            saved_validator = f.readline().rstrip(b"\n").decode("utf-8")
+            if saved_validator != validator:
+                return None
+            data = f.read()
+        try:
+            # marks it as recently used, so it's among the last to be evicted
+            utime(path)
+        except OSError:
+            pass
+        with tracing.span("load dom snapshot"):
+            return deserialize_dom(data)
+    except (OSError, ValueError, IndexError, struct.error):
+        # missing, or written by another version
+        return None
+
+
+def save_snapshot(url: str, validator: str, root):
+    """Saves root as the DOM of this version of the page at url, on the cache's writer thread.
+    Only styles are set on a DOM once it's parsed, so it can be read from there safely."""
+    def write():
+        with tracing.span("save dom snapshot"):
+            data = serialize_dom(root)
+        makedirs(SNAPSHOT_DIR, exist_ok=True)
+        atomic_write(snapshot_path(url), validator.encode("utf-8") + b"\n" + data)
+        evict_snapshots()
+
+    write_behind(write)
+
+
+def evict_snapshots(max_bytes: int = MAX_SNAPSHOT_BYTES):
+    """Deletes the least recently used snapshots until the rest fit in max_bytes"""
+    snapshots = []
+    with scandir(SNAPSHOT_DIR) as entries:
+        for entry in entries:
+            # skip files still being written by atomic_write
+            if entry.name.startswith("."):
+                continue
+            try:
+                info = entry.stat()
+            except OSError:
+                continue
+            snapshots.append((info.st_mtime_ns, info.st_size, entry.path))
+
+    total = sum(size for _, size, _ in snapshots)
+    for _, size, path in sorted(snapshots):
+        if total <= max_bytes:
+            break
+        try:
+            unlink(path)
+        except OSError:
+            # another process may have deleted it already
+            pass
+        total -= size
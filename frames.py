@@ -0,0 +1,101 @@
+"""Paces redraws to the display's refresh rate.
+
+Input handlers used to redraw straight away, so a fast mousewheel or a held down
+arrow key queued up far more redraws than could ever be shown. Instead, handlers
+update their state and ask the FrameScheduler for a frame. Requests are coalesced
+until the next tick, at most one per frame interval, which draws once.
+
+FrameStats keeps how long recent frames took to draw and how long input waited for
+them, so the effect of coalescing can be checked under a storm of events.
+"""
+from collections import deque
+from time import perf_counter
+
+import tracing
+
+# about 60 frames a second
+FRAME_MS = 16
+# how many recent frames the statistics are over
+STATS_WINDOW = 600
+
+
+def percentile(samples, fraction: float) -> float:
+    if not samples:
+        return 0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class FrameStats:
+    def __init__(self, window: int = STATS_WINDOW):
+        self.frames = 0
+        self.requests = 0
+        # in seconds, for the most recent frames
+        self.draw_times = deque(maxlen=window)
+        # from the first request a frame served until it started drawing
+        self.latencies = deque(maxlen=window)
+
+    def record(self, draw_time: float, latency: float, requests: int):
+        self.frames += 1
+        self.requests += requests
+        self.draw_times.append(draw_time)
+        self.latencies.append(latency)
+
+    def summary(self) -> dict:
+        """Frame counts, and draw times and input latencies in milliseconds"""
+        return {
+            "frames": self.frames,
+            "requests": self.requests,
+            "requests per frame": self.requests / self.frames if self.frames else 0,
+            "draw p50": percentile(self.draw_times, .5) * 1000,
+            "draw p95": percentile(self.draw_times, .95) * 1000,
+            "draw max": max(self.draw_times, default=0) * 1000,
+            "latency p50": percentile(self.latencies, .5) * 1000,
+            "latency p95": percentile(self.latencies, .95) * 1000,
+            "latency max": max(self.latencies, default=0) * 1000,
+        }
+
+
+class FrameScheduler:
+    def __init__(self, after, draw, frame_ms: int = FRAME_MS):
+        """after(delay_ms, callback) schedules a callback, like Tk's window.after,
+        and draw is called once per frame"""
+        self.after = after
+        self.draw = draw
+        self.frame_ms = frame_ms
+        self.stats = FrameStats()
+
+        self.tick_scheduled = False
+        self.last_frame = None
+        # when the oldest request the next frame will serve was made
+        self.first_request = None
+        self.pending_requests = 0
+
+    def request_frame(self):
+        """Marks the screen as needing a redraw, which happens on the next tick"""
+        self.pending_requests += 1
+        if self.first_request is None:
+            self.first_request = perf_counter()
+
+        if not self.tick_scheduled:
+            self.tick_scheduled = True
+            delay_ms = 0
+            if self.last_frame is not None:
+                since_last_ms = (perf_counter() - self.last_frame) * 1000
+                delay_ms = max(0, round(self.frame_ms - since_last_ms))
+            self.after(delay_ms, self.tick)
+
+    def tick(self):
+        self.tick_scheduled = False
+        start = perf_counter()
+        latency = start - self.first_request
+        requests = self.pending_requests
+        self.first_request = None
+        self.pending_requests = 0
+
+        self.draw()
+
+        # frames are paced from when they start, so drawing time doesn't add to the interval
+        self.last_frame = start
+        self.stats.record(perf_counter() - start, latency, requests)
+        tracing.count("frames")
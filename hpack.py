@@ -0,0 +1,303 @@
+"""HPACK, the header compression used by HTTP/2 (RFC 7541).
+
+Headers are sent as a list of (name, value) pairs, with names in lower case. The
+Encoder only refers to the static table and never Huffman codes, which keeps it
+simple and is always allowed. The Decoder handles everything a server may send:
+static and dynamic table references, literals and Huffman coded strings.
+"""
+
+# the entries every connection starts with, indexed from 1
+STATIC_TABLE = [
+    (":authority", ""),
+    (":method", "GET"),
+    (":method", "POST"),
+    (":path", "/"),
+    (":path", "/index.html"),
+    (":scheme", "http"),
+    (":scheme", "https"),
+    (":status", "200"),
+    (":status", "204"),
+    (":status", "206"),
+    (":status", "304"),
+    (":status", "400"),
+    (":status", "404"),
+    (":status", "500"),
+    ("accept-charset", ""),
+    ("accept-encoding", "gzip, deflate"),
+    ("accept-language", ""),
+    ("accept-ranges", ""),
+    ("accept", ""),
+    ("access-control-allow-origin", ""),
+    ("age", ""),
+    ("allow", ""),
+    ("authorization", ""),
+    ("cache-control", ""),
+    ("content-disposition", ""),
+    ("content-encoding", ""),
+    ("content-language", ""),
+    ("content-length", ""),
+    ("content-location", ""),
+    ("content-range", ""),
+    ("content-type", ""),
+    ("cookie", ""),
+    ("date", ""),
+    ("etag", ""),
+    ("expect", ""),
+    ("expires", ""),
+    ("from", ""),
+    ("host", ""),
+    ("if-match", ""),
+    ("if-modified-since", ""),
+    ("if-none-match", ""),
+    ("if-range", ""),
+    ("if-unmodified-since", ""),
+    ("last-modified", ""),
+    ("link", ""),
+    ("location", ""),
+    ("max-forwards", ""),
+    ("proxy-authenticate", ""),
+    ("proxy-authorization", ""),
+    ("range", ""),
+    ("referer", ""),
+    ("refresh", ""),
+    ("retry-after", ""),
+    ("server", ""),
+    ("set-cookie", ""),
+    ("strict-transport-security", ""),
+    ("transfer-encoding", ""),
+    ("user-agent", ""),
+    ("vary", ""),
+    ("via", ""),
+    ("www-authenticate", ""),
+]
+
+STATIC_INDEX = {entry: i for i, entry in reversed(
+    list(enumerate(STATIC_TABLE, 1)))}
+STATIC_NAME_INDEX = {name: i for i, (name, value) in reversed(
+    list(enumerate(STATIC_TABLE, 1)))}
+
+# the canonical Huffman code of each byte, and end of string (256), see RFC 7541 appendix B
+HUFFMAN_CODES = [
+    0x1ff8, 0x7fffd8, 0xfffffe2, 0xfffffe3, 0xfffffe4, 0xfffffe5, 0xfffffe6, 0xfffffe7,
+    0xfffffe8, 0xffffea, 0x3ffffffc, 0xfffffe9, 0xfffffea, 0x3ffffffd, 0xfffffeb, 0xfffffec,
+    0xfffffed, 0xfffffee, 0xfffffef, 0xffffff0, 0xffffff1, 0xffffff2, 0x3ffffffe, 0xffffff3,
+    0xffffff4, 0xffffff5, 0xffffff6, 0xffffff7, 0xffffff8, 0xffffff9, 0xffffffa, 0xffffffb,
+    0x14, 0x3f8, 0x3f9, 0xffa, 0x1ff9, 0x15, 0xf8, 0x7fa,
+    0x3fa, 0x3fb, 0xf9, 0x7fb, 0xfa, 0x16, 0x17, 0x18,
+    0x0, 0x1, 0x2, 0x19, 0x1a, 0x1b, 0x1c, 0x1d,
+    0x1e, 0x1f, 0x5c, 0xfb, 0x7ffc, 0x20, 0xffb, 0x3fc,
+    0x1ffa, 0x21, 0x5d, 0x5e, 0x5f, 0x60, 0x61, 0x62,
+    0x63, 0x64, 0x65, 0x66, 0x67, 0x68, 0x69, 0x6a,
+    0x6b, 0x6c, 0x6d, 0x6e, 0x6f, 0x70, 0x71, 0x72,
+    0xfc, 0x73, 0xfd, 0x1ffb, 0x7fff0, 0x1ffc, 0x3ffc, 0x22,
+    0x7ffd, 0x3, 0x23, 0x4, 0x24, 0x5, 0x25, 0x26,
+    0x27, 0x6, 0x74, 0x75, 0x28, 0x29, 0x2a, 0x7,
+    0x2b, 0x76, 0x2c, 0x8, 0x9, 0x2d, 0x77, 0x78,
+    0x79, 0x7a, 0x7b, 0x7ffe, 0x7fc, 0x3ffd, 0x1ffd, 0xffffffc,
+    0xfffe6, 0x3fffd2, 0xfffe7, 0xfffe8, 0x3fffd3, 0x3fffd4, 0x3fffd5, 0x7fffd9,
+    0x3fffd6, 0x7fffda, 0x7fffdb, 0x7fffdc, 0x7fffdd, 0x7fffde, 0xffffeb, 0x7fffdf,
+    0xffffec, 0xffffed, 0x3fffd7, 0x7fffe0, 0xffffee, 0x7fffe1, 0x7fffe2, 0x7fffe3,
+    0x7fffe4, 0x1fffdc, 0x3fffd8, 0x7fffe5, 0x3fffd9, 0x7fffe6, 0x7fffe7, 0xffffef,
+    0x3fffda, 0x1fffdd, 0xfffe9, 0x3fffdb, 0x3fffdc, 0x7fffe8, 0x7fffe9, 0x1fffde,
+    0x7fffea, 0x3fffdd, 0x3fffde, 0xfffff0, 0x1fffdf, 0x3fffdf, 0x7fffeb, 0x7fffec,
+    0x1fffe0, 0x1fffe1, 0x3fffe0, 0x1fffe2, 0x7fffed, 0x3fffe1, 0x7fffee, 0x7fffef,
+    0xfffea, 0x3fffe2, 0x3fffe3, 0x3fffe4, 0x7ffff0, 0x3fffe5, 0x3fffe6, 0x7ffff1,
+    0x3ffffe0, 0x3ffffe1, 0xfffeb, 0x7fff1, 0x3fffe7, 0x7ffff2, 0x3fffe8, 0x1ffffec,
+    0x3ffffe2, 0x3ffffe3, 0x3ffffe4, 0x7ffffde, 0x7ffffdf, 0x3ffffe5, 0xfffff1, 0x1ffffed,
+    0x7fff2, 0x1fffe3, 0x3ffffe6, 0x7ffffe0, 0x7ffffe1, 0x3ffffe7, 0x7ffffe2, 0xfffff2,
+    0x1fffe4, 0x1fffe5, 0x3ffffe8, 0x3ffffe9, 0xffffffd, 0x7ffffe3, 0x7ffffe4, 0x7ffffe5,
+    0xfffec, 0xfffff3, 0xfffed, 0x1fffe6, 0x3fffe9, 0x1fffe7, 0x1fffe8, 0x7ffff3,
+    0x3fffea, 0x3fffeb, 0x1ffffee, 0x1ffffef, 0xfffff4, 0xfffff5, 0x3ffffea, 0x7ffff4,
+    0x3ffffeb, 0x7ffffe6, 0x3ffffec, 0x3ffffed, 0x7ffffe7, 0x7ffffe8, 0x7ffffe9, 0x7ffffea,
+    0x7ffffeb, 0xffffffe, 0x7ffffec, 0x7ffffed, 0x7ffffee, 0x7ffffef, 0x7fffff0, 0x3ffffee,
+    0x3fffffff,
+]
+HUFFMAN_CODE_LENGTHS = [
+    13, 23, 28, 28, 28, 28, 28, 28, 28, 24, 30, 28, 28, 30, 28, 28,
+    28, 28, 28, 28, 28, 28, 30, 28, 28, 28, 28, 28, 28, 28, 28, 28,
+    6, 10, 10, 12, 13, 6, 8, 11, 10, 10, 8, 11, 8, 6, 6, 6,
+    5, 5, 5, 6, 6, 6, 6, 6, 6, 6, 7, 8, 15, 6, 12, 10,
+    13, 6, 7, 7, 7, 7, 7, 7, 7, 7, 7, 7, 7, 7, 7, 7,
+    7, 7, 7, 7, 7, 7, 7, 7, 8, 7, 8, 13, 19, 13, 14, 6,
+    15, 5, 6, 5, 6, 5, 6, 6, 6, 5, 7, 7, 6, 6, 6, 5,
+    6, 7, 6, 5, 5, 6, 7, 7, 7, 7, 7, 15, 11, 14, 13, 28,
+    20, 22, 20, 20, 22, 22, 22, 23, 22, 23, 23, 23, 23, 23, 24, 23,
+    24, 24, 22, 23, 24, 23, 23, 23, 23, 21, 22, 23, 22, 23, 23, 24,
+    22, 21, 20, 22, 22, 23, 23, 21, 23, 22, 22, 24, 21, 22, 23, 23,
+    21, 21, 22, 21, 23, 22, 23, 23, 20, 22, 22, 22, 23, 22, 22, 23,
+    26, 26, 20, 19, 22, 23, 22, 25, 26, 26, 26, 27, 27, 26, 24, 25,
+    19, 21, 26, 27, 27, 26, 27, 24, 21, 21, 26, 26, 28, 27, 27, 27,
+    20, 24, 20, 21, 22, 21, 21, 23, 22, 22, 25, 25, 24, 24, 26, 23,
+    26, 27, 26, 26, 27, 27, 27, 27, 27, 28, 27, 27, 27, 27, 27, 26,
+    30,
+]
+
+# maps (code length, code) to the symbol it stands for
+HUFFMAN_SYMBOLS = {(length, code): symbol for symbol, (code, length) in
+                   enumerate(zip(HUFFMAN_CODES, HUFFMAN_CODE_LENGTHS))}
+EOS = 256
+
+# every entry costs its name and value plus this many bytes against the table size
+ENTRY_OVERHEAD = 32
+DEFAULT_TABLE_SIZE = 4096
+
+
+class HPACKError(Exception):
+    pass
+
+
+def encode_integer(value: int, prefix_bits: int, flags: int = 0) -> bytes:
+    limit = (1 << prefix_bits) - 1
+    if value < limit:
+        return bytes([flags | value])
+
+    encoded = bytearray([flags | limit])
+    value -= limit
+    while value >= 128:
+        encoded.append(value & 0x7f | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def decode_integer(data: bytes, pos: int, prefix_bits: int) -> tuple[int, int]:
+    """Returns the integer starting at pos, and the position after it"""
+    limit = (1 << prefix_bits) - 1
+    value = data[pos] & limit
+    pos += 1
+    if value < limit:
+        return value, pos
+
+    shift = 0
+    while True:
+        if pos >= len(data):
+            raise HPACKError("truncated integer")
+        byte = data[pos]
+        pos += 1
+        value += (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, pos
+
+
+def encode_string(text: str) -> bytes:
+    encoded = text.encode("utf-8")
+    return encode_integer(len(encoded), 7) + encoded
+
+
+def huffman_decode(data: bytes) -> bytes:
+    decoded = bytearray()
+    code = length = 0
+    for byte in data:
+        for shift in range(7, -1, -1):
+            code = code << 1 | (byte >> shift) & 1
+            length += 1
+            symbol = HUFFMAN_SYMBOLS.get((length, code))
+            if symbol is None:
+                if length >= 30:
+                    raise HPACKError("invalid Huffman code")
+                continue
+            if symbol == EOS:
+                raise HPACKError("end of string in Huffman coded string")
+            decoded.append(symbol)
+            code = length = 0
+
+    # the last byte is padded with the most significant bits of EOS, which are all ones
+    if length > 7 or code != (1 << length) - 1:
+        raise HPACKError("invalid Huffman padding")
+    return bytes(decoded)
+
+
+def decode_string(data: bytes, pos: int) -> tuple[str, int]:
+    huffman = data[pos] & 0x80
+    length, pos = decode_integer(data, pos, 7)
+    if pos + length > len(data):
+        raise HPACKError("truncated string")
+
+    raw = data[pos:pos + length]
+    if huffman:
+        raw = huffman_decode(raw)
+    return raw.decode("utf-8", "ignore"), pos + length
+
+
+class Encoder:
+    def encode(self, headers) -> bytes:
+        block = bytearray()
+        for name, value in headers:
+            index = STATIC_INDEX.get((name, value))
+            if index:
+                # indexed header field
+                block += encode_integer(index, 7, 0x80)
+                continue
+
+            # literal header field without indexing, naming the static entry when there is one
+            name_index = STATIC_NAME_INDEX.get(name, 0)
+            block += encode_integer(name_index, 4)
+            if not name_index:
+                block += encode_string(name)
+            block += encode_string(value)
+        return bytes(block)
+
+
+class Decoder:
+    def __init__(self, max_table_size: int = DEFAULT_TABLE_SIZE):
+        # the limit the peer was told it may use, which it can lower (and raise back to) with updates
+        self.max_table_size = max_table_size
+        self.table_size = max_table_size
+        # newest first, so dynamic entries are indexed from len(STATIC_TABLE) + 1
+        self.dynamic_table = []
+        self.size = 0
+
+    def entry(self, index: int) -> tuple[str, str]:
+        if 0 < index <= len(STATIC_TABLE):
+            return STATIC_TABLE[index - 1]
+        index -= len(STATIC_TABLE) + 1
+        if 0 <= index < len(self.dynamic_table):
+            return self.dynamic_table[index]
+        raise HPACKError(f"invalid header table index {index}")
+
+    def add(self, name: str, value: str):
+        self.dynamic_table.insert(0, (name, value))
+        self.size += len(name) + len(value) + ENTRY_OVERHEAD
+        self.evict()
+
+    def evict(self):
+        while self.size > self.table_size:
+            name, value = self.dynamic_table.pop()
+            self.size -= len(name) + len(value) + ENTRY_OVERHEAD
+
+    def decode(self, block: bytes) -> list:
+        headers = []
+        pos = 0
+        while pos < len(block):
+            byte = block[pos]
+
+            if byte & 0x80:
+                # indexed header field
+                index, pos = decode_integer(block, pos, 7)
+                headers.append(self.entry(index))
+                continue
+
+            if byte & 0xe0 == 0x20:
+                # dynamic table size update
+                size, pos = decode_integer(block, pos, 5)
+                if size > self.max_table_size:
+                    raise HPACKError("header table size update over the limit")
+                self.table_size = size
+                self.evict()
+                continue
+
+            # literal header field, with incremental indexing or not (or never) indexed
+            indexing = byte & 0x40
+            index, pos = decode_integer(block, pos, 6 if indexing else 4)
+            if index:
+                name = self.entry(index)[0]
+            else:
+                name, pos = decode_string(block, pos)
+            value, pos = decode_string(block, pos)
+
+            if indexing:
+                self.add(name, value)
+            headers.append((name, value))
+
+        return headers
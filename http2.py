@@ -0,0 +1,393 @@
+"""HTTP/2 client connections (RFC 9113).
+
+Over HTTP/1.1 every request opens (and closes) a connection of its own. An HTTP/2
+connection is kept open per origin and shared by all requests to it, each on a
+stream of its own, so a page and all of its stylesheets can be fetched over one
+connection, with requests from several threads in flight at once.
+
+HTTP/2 is negotiated with ALPN over TLS, see request.fetch_response. Cleartext
+HTTP/2 (h2c) is only spoken to origins added to PRIOR_KNOWLEDGE, e.g. local test
+servers, since upgrading from HTTP/1.1 isn't supported.
+"""
+import struct
+import threading
+from http import HTTPStatus
+
+from hpack import Decoder, Encoder, HPACKError
+
+PREFACE = b"PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n"
+
+# frame types
+DATA = 0x0
+HEADERS = 0x1
+PRIORITY = 0x2
+RST_STREAM = 0x3
+SETTINGS = 0x4
+PUSH_PROMISE = 0x5
+PING = 0x6
+GOAWAY = 0x7
+WINDOW_UPDATE = 0x8
+CONTINUATION = 0x9
+
+# frame flags
+END_STREAM = 0x1
+ACK = 0x1
+END_HEADERS = 0x4
+PADDED = 0x8
+PRIORITY_FLAG = 0x20
+
+# the payload lengths of frames that are always the same length, anything else is a connection error
+FRAME_LENGTHS = {PRIORITY: 5, RST_STREAM: 4, PING: 8, WINDOW_UPDATE: 4}
+
+# settings
+SETTINGS_HEADER_TABLE_SIZE = 0x1
+SETTINGS_ENABLE_PUSH = 0x2
+SETTINGS_MAX_CONCURRENT_STREAMS = 0x3
+SETTINGS_INITIAL_WINDOW_SIZE = 0x4
+SETTINGS_MAX_FRAME_SIZE = 0x5
+
+DEFAULT_WINDOW_SIZE = 65535
+DEFAULT_MAX_FRAME_SIZE = 16384
+# how much the server may send on each stream, and on the connection, before we acknowledge it
+WINDOW_SIZE = 1 << 24
+MAX_STREAM_ID = (1 << 31) - 1
+
+# ports left out of :authority, as they go without saying
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# (host, port) of servers known to speak cleartext HTTP/2
+PRIOR_KNOWLEDGE = set()
+
+# open connections, keyed by (scheme, host, port)
+CONNECTIONS = {}
+CONNECTIONS_LOCK = threading.Lock()
+
+
+class HTTP2Error(ConnectionError):
+    pass
+
+
+class Stream:
+    __slots__ = ("status", "headers", "body", "done", "error", "unacknowledged")
+
+    def __init__(self):
+        self.status = None
+        self.headers = []
+        self.body = bytearray()
+        self.done = False
+        self.error = None
+        # bytes received since the stream's flow control window was last topped up
+        self.unacknowledged = 0
+
+
+class HTTP2Connection:
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = sock.makefile("rb")
+        self.encoder = Encoder()
+        self.decoder = Decoder()
+
+        # guards everything below. threads waiting on a response take turns to read
+        # frames off the socket, handing each to the stream it's for.
+        self.condition = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.reading = False
+        self.streams = {}
+        self.next_stream_id = 1
+        self.max_concurrent_streams = None
+        self.max_frame_size = DEFAULT_MAX_FRAME_SIZE
+        self.unacknowledged = 0
+        # a header block being continued in CONTINUATION frames, as (stream id, fragments, end stream)
+        self.continued_headers = None
+        self.going_away = False
+        self.error = None
+
+        self.sock.sendall(PREFACE)
+        self.send_frame(SETTINGS, 0, 0, b"".join(struct.pack("!HI", setting, value) for setting, value in [
+            (SETTINGS_ENABLE_PUSH, 0),
+            (SETTINGS_INITIAL_WINDOW_SIZE, WINDOW_SIZE),
+        ]))
+        self.send_frame(WINDOW_UPDATE, 0, 0, struct.pack(
+            "!I", WINDOW_SIZE - DEFAULT_WINDOW_SIZE))
+
+    def usable(self) -> bool:
+        """Whether new requests can be made on this connection"""
+        return not self.error and not self.going_away and self.next_stream_id < MAX_STREAM_ID
+
+    def close(self, error="connection closed"):
+        self.error = self.error or error
+        for stream in self.streams.values():
+            if not stream.done:
+                stream.error = self.error
+                stream.done = True
+        self.sock.close()
+
+    def send_frame(self, type: int, flags: int, stream_id: int, payload: bytes = b""):
+        header = struct.pack("!IBI", len(payload), flags, stream_id)
+        # the length is 24 bits, so the first byte of the 32 bit integer is dropped
+        with self.write_lock:
+            self.sock.sendall(header[1:4] + bytes([type]) + header[4:] + payload)
+
+    def send_headers(self, stream_id: int, block: bytes):
+        """Sends a header block, in as many frames as it takes, ending the stream"""
+        fragments = [block[i:i + self.max_frame_size]
+                     for i in range(0, len(block), self.max_frame_size)] or [b""]
+        for i, fragment in enumerate(fragments):
+            flags = END_HEADERS if i == len(fragments) - 1 else 0
+            if i == 0:
+                self.send_frame(HEADERS, flags | END_STREAM, stream_id, fragment)
+            else:
+                self.send_frame(CONTINUATION, flags, stream_id, fragment)
+
+    def read_exactly(self, size: int) -> bytes:
+        data = self.reader.read(size)
+        if len(data) < size:
+            raise HTTP2Error("connection closed by server")
+        return data
+
+    def read_frame(self):
+        header = self.read_exactly(9)
+        length = int.from_bytes(header[:3], "big")
+        type, flags, stream_id = header[3], header[4], int.from_bytes(
+            header[5:], "big") & MAX_STREAM_ID
+        return type, flags, stream_id, self.read_exactly(length)
+
+    def request(self, headers) -> Stream:
+        """Sends a GET request with the given (name, value) headers, including the
+        pseudo-headers, and waits for the whole response"""
+        with self.condition:
+            while self.usable() and self.max_concurrent_streams is not None \
+                    and len(self.streams) >= self.max_concurrent_streams:
+                self.condition.wait()
+            if not self.usable():
+                raise HTTP2Error(self.error or "connection is going away")
+
+            # streams have to be opened in the order of their ids, so this happens under the lock
+            stream_id = self.next_stream_id
+            self.next_stream_id += 2
+            stream = self.streams[stream_id] = Stream()
+
+            try:
+                self.send_headers(stream_id, self.encoder.encode(headers))
+                self.wait_for(stream)
+            except OSError as e:
+                # the connection broke while sending, so no stream on it can get a response
+                self.close(str(e))
+                raise
+            finally:
+                del self.streams[stream_id]
+                self.condition.notify_all()
+                if self.going_away and not self.streams:
+                    self.close()
+
+        if stream.error:
+            raise HTTP2Error(stream.error)
+        if stream.status is None:
+            # e.g. only informational responses, or a DATA frame with END_STREAM before any headers
+            raise HTTP2Error("stream ended without a response")
+        return stream
+
+    def wait_for(self, stream: Stream):
+        # called with the condition held
+        while not stream.done:
+            if self.reading:
+                self.condition.wait()
+                continue
+
+            self.reading = True
+            self.condition.release()
+            try:
+                frame = self.read_frame()
+            except (OSError, ValueError) as e:
+                frame = None
+                error = str(e)
+            finally:
+                self.condition.acquire()
+                self.reading = False
+
+            try:
+                if frame is None:
+                    self.close(error)
+                else:
+                    self.handle_frame(*frame)
+            except (HPACKError, OSError) as e:
+                # protocol errors, and errors decoding headers (which leave the header table
+                # out of sync), are the end of the connection
+                self.close(str(e))
+            self.condition.notify_all()
+
+    def handle_frame(self, type: int, flags: int, stream_id: int, payload: bytes):
+        if self.continued_headers and type != CONTINUATION:
+            raise HTTP2Error("header block interrupted")
+        check_frame_length(type, flags, payload)
+
+        # flow control counts all of a DATA frame's payload, padding included
+        size = len(payload)
+        if type in (DATA, HEADERS) and flags & PADDED:
+            padding = payload[0]
+            payload = payload[1:len(payload) - padding]
+
+        stream = self.streams.get(stream_id)
+
+        if type == DATA:
+            if stream:
+                stream.body += payload
+            self.acknowledge(stream_id, stream, size, flags & END_STREAM)
+            if stream and flags & END_STREAM:
+                stream.done = True
+
+        elif type == HEADERS:
+            if flags & PRIORITY_FLAG:
+                payload = payload[5:]
+            self.continued_headers = (stream_id, [payload], flags & END_STREAM)
+            if flags & END_HEADERS:
+                self.end_headers()
+
+        elif type == CONTINUATION:
+            if not self.continued_headers or self.continued_headers[0] != stream_id:
+                raise HTTP2Error("unexpected CONTINUATION frame")
+            self.continued_headers[1].append(payload)
+            if flags & END_HEADERS:
+                self.end_headers()
+
+        elif type == RST_STREAM:
+            if stream:
+                error_code, = struct.unpack("!I", payload)
+                stream.error = f"stream reset by server with error code {error_code}"
+                stream.done = True
+
+        elif type == SETTINGS:
+            if flags & ACK:
+                return
+            for i in range(0, len(payload), 6):
+                setting, value = struct.unpack("!HI", payload[i:i + 6])
+                if setting == SETTINGS_MAX_CONCURRENT_STREAMS:
+                    self.max_concurrent_streams = value
+                elif setting == SETTINGS_MAX_FRAME_SIZE:
+                    self.max_frame_size = value
+                # only GET requests are sent, with headers never added to the server's
+                # header table, so its window and table sizes don't matter
+            self.send_frame(SETTINGS, ACK, 0)
+
+        elif type == PING:
+            if not flags & ACK:
+                self.send_frame(PING, ACK, 0, payload)
+
+        elif type == GOAWAY:
+            last_stream_id, error_code = struct.unpack("!II", payload[:8])
+            self.going_away = True
+            for id, refused in self.streams.items():
+                if id > last_stream_id & MAX_STREAM_ID:
+                    refused.error = f"refused by server going away with error code {error_code}"
+                    refused.done = True
+
+        elif type == PUSH_PROMISE:
+            raise HTTP2Error("server push was disabled")
+
+        # PRIORITY, WINDOW_UPDATE (only headers are sent, which aren't flow controlled) and
+        # unknown frame types are ignored
+
+    def end_headers(self):
+        stream_id, fragments, end_stream = self.continued_headers
+        self.continued_headers = None
+
+        # every header block has to be decoded to keep the header table in sync
+        headers = self.decoder.decode(b"".join(fragments))
+        stream = self.streams.get(stream_id)
+        if not stream:
+            return
+
+        status = dict(headers).get(":status", "")
+        if stream.status is None and not status.startswith("1"):
+            stream.status = status
+            stream.headers = [(name, value) for name, value in headers
+                              if not name.startswith(":")]
+        # informational responses are skipped, and trailers are ignored
+
+        if end_stream:
+            stream.done = True
+
+    def acknowledge(self, stream_id: int, stream: Stream, size: int, end_stream: bool):
+        """Tops up flow control windows once half of them has been used"""
+        self.unacknowledged += size
+        if self.unacknowledged >= WINDOW_SIZE // 2:
+            self.send_frame(WINDOW_UPDATE, 0, 0,
+                            struct.pack("!I", self.unacknowledged))
+            self.unacknowledged = 0
+
+        if stream and not end_stream:
+            stream.unacknowledged += size
+            if stream.unacknowledged >= WINDOW_SIZE // 2:
+                self.send_frame(WINDOW_UPDATE, 0, stream_id,
+                                struct.pack("!I", stream.unacknowledged))
+                stream.unacknowledged = 0
+
+    def fetch(self, scheme: str, host: str, port: int, path: str, headers: dict) -> bytes:
+        """Makes a GET request, returning the response in the same shape as an HTTP/1.1
+        response, so it's parsed and cached the same way"""
+        authority = host if port == DEFAULT_PORTS.get(scheme) else f"{host}:{port}"
+        stream = self.request([
+            (":method", "GET"),
+            (":scheme", scheme),
+            (":authority", authority),
+            (":path", path),
+        ] + [(name.lower(), value) for name, value in headers.items()])
+
+        try:
+            reason = HTTPStatus(int(stream.status)).phrase
+        except ValueError:
+            reason = "Unknown"
+
+        response = f"HTTP/2 {stream.status} {reason}\r\n"
+        for name, value in stream.headers:
+            response += f"{name}: {value}\r\n"
+        response += "\r\n"
+        return response.encode("utf-8") + bytes(stream.body)
+
+
+def check_frame_length(type: int, flags: int, payload: bytes):
+    """Raises HTTP2Error if the payload is too short (or long) for the frame to be read"""
+    length = len(payload)
+    if type in FRAME_LENGTHS:
+        valid = length == FRAME_LENGTHS[type]
+    elif type == SETTINGS:
+        valid = length % 6 == 0 and not (flags & ACK and length)
+    elif type == GOAWAY:
+        valid = length >= 8
+    elif type in (DATA, HEADERS):
+        # the padding length, then at least as much padding, then a priority for headers that have one
+        header = (1 if flags & PADDED else 0) + (5 if type == HEADERS and flags & PRIORITY_FLAG else 0)
+        valid = length >= header and (not flags & PADDED or payload[0] <= length - header)
+    else:
+        valid = True
+    if not valid:
+        raise HTTP2Error(f"frame of type {type} with a bad length of {length}")
+
+
+def pooled_connection(origin: tuple):
+    """The open connection to origin, if there is one that can take more requests"""
+    with CONNECTIONS_LOCK:
+        connection = CONNECTIONS.get(origin)
+        if connection and not connection.usable():
+            del CONNECTIONS[origin]
+            connection = None
+        return connection
+
+
+def add_connection(origin: tuple, connection: HTTP2Connection) -> HTTP2Connection:
+    """Keeps connection open for more requests to origin, returning whichever connection
+    should be used in case another thread opened one first"""
+    with CONNECTIONS_LOCK:
+        existing = CONNECTIONS.get(origin)
+        if existing and existing.usable():
+            connection.close()
+            return existing
+        CONNECTIONS[origin] = connection
+        return connection
+
+
+def forget_connection(origin: tuple, connection: HTTP2Connection):
+    with CONNECTIONS_LOCK:
+        if CONNECTIONS.get(origin) is connection:
+            del CONNECTIONS[origin]
+    connection.close()
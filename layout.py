@@ -1,5 +1,9 @@
-from dom import Text, Element
+from bisect import bisect_right
+from dom import NO_CHILDREN, Text, Element, walk_tree
+from itertools import accumulate
+from unicodedata import east_asian_width
 import tkinter
+import tkinter.font
 
 HSTEP, VSTEP = 13, 18
 PSTEP = VSTEP * .5
@@ -15,6 +19,26 @@ SHOW_LAYOUTS = {
 }
 
 FONTS = {}
+# maps a font's name back to its get_font arguments, so draw commands can be serialized
+FONT_KEYS = {}
+
+# when set, fonts are measured with HeadlessFont instead of Tk, which needs a display
+HEADLESS = False
+
+# maps a font's name to the widths of text measured in it, see measure
+TEXT_WIDTHS = {}
+MAX_CACHED_WIDTHS = 100_000
+FONT_METRICS = {}
+# maps the content, position and width of inline layouts to their lines and words, see InlineLayout.layout
+INLINE_FORMATTING = {}
+# the cache is bounded by the number of words in it, since that's what takes up the memory
+MAX_CACHED_FORMATTING_WORDS = 200_000
+# shorter runs of text are laid out about as quickly as they're looked up
+MIN_CACHED_FORMATTING_TEXT = 200
+cached_formatting_words = 0
+# maps (font name, text) to its words and their running widths, see measure_words
+WORD_RUNS = {}
+MAX_CACHED_RUNS = 10_000
 
 
 def draw_bounding_rect(layout, fill=None, border_color=None):
@@ -23,25 +47,130 @@ def draw_bounding_rect(layout, fill=None, border_color=None):
 
 def get_font(size, weight, slant):
     key = (size, weight, slant)
-    if key not in FONTS:
-        font = tkinter.font.Font(size=size, weight=weight, slant=slant)
+    font = FONTS.get(key)
+    if font is None:
+        if HEADLESS:
+            font = HeadlessFont(size, weight, slant)
+        else:
+            font = tkinter.font.Font(size=size, weight=weight, slant=slant)
         FONTS[key] = font
-    return FONTS[key]
-
-
-def maybe_hyphenate(word: str, too_long):
-    before_hyphen = ''
-    after_hyphen = ''
-    if '\N{soft hyphen}' in word:
-        past_hyphen = False
-        for piece in word.split('\N{soft hyphen}'):
-            if not past_hyphen and not too_long(before_hyphen + piece + '-'):
-                before_hyphen += piece
-            else:
-                past_hyphen = True
-                after_hyphen += piece
-
-    return before_hyphen, after_hyphen
+        FONT_KEYS[font.name] = key
+    return font
+
+
+def use_headless_fonts():
+    """Switches get_font to HeadlessFont, e.g. in worker processes without a display"""
+    global HEADLESS
+    HEADLESS = True
+    FONTS.clear()
+    FONT_KEYS.clear()
+    clear_caches()
+
+
+def clear_caches():
+    """Forgets every measurement and laid out run of text, e.g. to time layout from cold"""
+    global cached_formatting_words
+    TEXT_WIDTHS.clear()
+    FONT_METRICS.clear()
+    WORD_RUNS.clear()
+    INLINE_FORMATTING.clear()
+    cached_formatting_words = 0
+
+
+# Helvetica's advance widths (in thousandths of an em) for printable ASCII, starting at space
+HELVETICA_WIDTHS = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+]
+CHAR_WIDTHS = {chr(32 + i): width for i, width in enumerate(HELVETICA_WIDTHS)}
+
+
+class HeadlessFont:
+    """Approximates the metrics of Tk's default font without needing a display.
+    Follows the subset of the tkinter.font.Font interface that layout uses."""
+
+    def __init__(self, size, weight, slant):
+        self.name = f"headless-{size}-{weight}-{slant}"
+        # Tk font sizes are in points, at 96 dpi that's 4/3 of a pixel each
+        pixels = size * 4 / 3
+        self.em = pixels * (1.05 if weight == "bold" else 1)
+        self.ascent = round(pixels * 0.905)
+        self.descent = round(pixels * 0.212)
+
+    def measure(self, text: str) -> int:
+        thousandths = 0
+        for char in text:
+            width = CHAR_WIDTHS.get(char)
+            if width is None:
+                width = 1000 if east_asian_width(char) in "WF" else 556
+            thousandths += width
+        return round(thousandths * self.em / 1000)
+
+    def metrics(self, *options):
+        metrics = {
+            "ascent": self.ascent,
+            "descent": self.descent,
+            "linespace": self.ascent + self.descent,
+            "fixed": 0,
+        }
+        if len(options) == 1:
+            return metrics[options[0]]
+        return metrics
+
+
+def measure(font, text: str) -> int:
+    """font.measure, remembering the width of each piece of text per font.
+    Pages use the same words over and over, and measuring goes all the way to Tk."""
+    widths = TEXT_WIDTHS.get(font.name)
+    if widths is None:
+        widths = TEXT_WIDTHS[font.name] = {}
+    width = widths.get(text)
+    if width is None:
+        if len(widths) >= MAX_CACHED_WIDTHS:
+            widths.clear()
+        width = widths[text] = font.measure(text)
+    return width
+
+
+def get_metrics(font) -> dict:
+    """font.metrics(), which is asked for once per word or more, fetched from Tk once per font"""
+    metrics = FONT_METRICS.get(font.name)
+    if metrics is None:
+        metrics = FONT_METRICS[font.name] = font.metrics()
+    return metrics
+
+
+def measure_words(font, text: str):
+    """Splits text into words, along with the running total of their widths, each with a trailing space.
+    Long paragraphs are laid out again at every width the window is resized to, so these are cached."""
+    key = (font.name, text)
+    run = WORD_RUNS.get(key)
+    if run is None:
+        if len(WORD_RUNS) >= MAX_CACHED_RUNS:
+            WORD_RUNS.clear()
+        words = text.split()
+        space_width = measure(font, " ")
+        advances = list(accumulate(
+            (measure(font, word) + space_width for word in words), initial=0))
+        run = WORD_RUNS[key] = (words, advances)
+    return run
+
+
+def maybe_hyphenate(word: str, font, max_width):
+    """Splits word at the last soft hyphen where the part before it, plus a hyphen, fits in max_width.
+    Each piece is measured once, and their widths summed, rather than measuring every prefix."""
+    if '\N{soft hyphen}' not in word:
+        return '', word
+
+    pieces = word.split('\N{soft hyphen}')
+    prefix_widths = list(accumulate(measure(font, piece) for piece in pieces))
+    fits = bisect_right(prefix_widths, max_width - measure(font, '-'))
+
+    return ''.join(pieces[:fits]), ''.join(pieces[fits:])
 
 
 # source: https://html.spec.whatwg.org/multipage/#toc-semantics
@@ -70,20 +199,25 @@ def get_layout_mode(node: Text | Element) -> str:
 
 
 class DrawText:
+    # there is one of these per word, so they are slotted to save memory
+    __slots__ = ("top", "left", "bottom", "text", "font", "color")
+
     def __init__(self, x1: int, y1: int, text: str, font: tkinter.font.Font, color: str):
         self.top = y1
         self.left = x1
-        self.bottom = y1 + font.metrics("linespace")
+        self.bottom = y1 + get_metrics(font)["linespace"]
         self.text = text
         self.font = font
         self.color = color
 
-    def execute(self, scroll: int, canvas: tkinter.Canvas):
+    def execute(self, scroll: int, canvas: tkinter.Canvas, tags=()):
         canvas.create_text(self.left, self.top - scroll,
-                           text=self.text, font=self.font, fill=self.color, anchor="nw")
+                           text=self.text, font=self.font, fill=self.color, anchor="nw", tags=tags)
 
 
 class DrawRect:
+    __slots__ = ("top", "left", "bottom", "right", "fill", "border_color")
+
     def __init__(self, x1, y1, x2, y2, fill=None, border_color=None):
         self.top = y1
         self.left = x1
@@ -92,7 +226,7 @@ class DrawRect:
         self.fill = fill
         self.border_color = border_color
 
-    def execute(self, scroll: int, canvas: tkinter.Canvas):
+    def execute(self, scroll: int, canvas: tkinter.Canvas, tags=()):
         border_width = 2 if self.border_color else 0
 
         canvas.create_rectangle(
@@ -100,15 +234,48 @@ class DrawRect:
             self.right, self.bottom - scroll,
             width=border_width,
             outline=self.border_color,
-            fill=self.fill
+            fill=self.fill,
+            tags=tags
         )
 
 
+def serialize_display_list(display_list) -> list:
+    """Flattens draw commands into plain tuples, so they can be sent between processes"""
+    commands = []
+    for command in display_list:
+        if isinstance(command, DrawText):
+            commands.append(("text", command.left, command.top, command.bottom,
+                             command.text, FONT_KEYS[command.font.name], command.color))
+        else:
+            commands.append(("rect", command.left, command.top, command.right,
+                             command.bottom, command.fill, command.border_color))
+    return commands
+
+
+def deserialize_display_list(commands: list):
+    display_list = []
+    for command in commands:
+        if command[0] == "text":
+            _, left, top, bottom, text, font_key, color = command
+            draw = DrawText(left, top, text, get_font(*font_key), color)
+            # keep the extent the page was laid out with, even if this font measures differently
+            draw.bottom = bottom
+        else:
+            _, left, top, right, bottom, fill, border_color = command
+            draw = DrawRect(left, top, right, bottom, fill, border_color)
+        display_list.append(draw)
+    return display_list
+
+
 class TextLayout:
+    # there is one of these per word, so they are slotted to save memory
+    __slots__ = ("node", "word", "children", "parent", "previous",
+                 "font", "width", "height", "x", "y")
+
     def __init__(self, node, word, parent, previous):
         self.node = node
         self.word = word
-        self.children = []
+        self.children = NO_CHILDREN
         self.parent = parent
         self.previous = previous
 
@@ -120,18 +287,18 @@ class TextLayout:
         style = self.node.style["font-style"]
         if style == "normal":
             style = "roman"
-        size = int(float(self.node.style["font-size"][:-2]) * .75)
+        size = int(self.node.style["font-size"] * .75)
         self.font = get_font(size, weight, style)
 
-        self.width = self.font.measure(self.word)
+        self.width = measure(self.font, self.word)
 
         if self.previous:
-            space = self.previous.font.measure(" ")
+            space = measure(self.previous.font, " ")
             self.x = self.previous.x + space + self.previous.width
         else:
             self.x = self.parent.x
 
-        self.height = self.font.metrics("linespace")
+        self.height = get_metrics(self.font)["linespace"]
 
     def paint(self, display_list):
         color = self.node.style["color"]
@@ -143,6 +310,9 @@ class TextLayout:
 
 
 class LineLayout:
+    __slots__ = ("node", "parent", "previous", "children",
+                 "width", "height", "x", "y")
+
     def __init__(self, node, parent, previous):
         self.node = node
         self.parent = parent
@@ -171,13 +341,13 @@ class LineLayout:
         for word in self.children:
             word.layout()
 
-        max_ascent = max([word.font.metrics("ascent")
+        max_ascent = max([get_metrics(word.font)["ascent"]
                           for word in self.children])
         baseline = self.y + 1.25 * max_ascent
         for word in self.children:
-            word.y = baseline - word.font.metrics("ascent")
+            word.y = baseline - get_metrics(word.font)["ascent"]
 
-        max_descent = max([word.font.metrics("descent")
+        max_descent = max([get_metrics(word.font)["descent"]
                            for word in self.children])
 
         self.height = 1.25 * (max_ascent + max_descent)
@@ -212,17 +382,87 @@ class InlineLayout:
             self.y = self.parent.y
         self.cursor_x = self.x
 
+        content, key = self.formatting_key()
+        formatting = INLINE_FORMATTING.get(key) if key else None
+        if formatting is not None:
+            # the same content has been laid out at this position and width before
+            self.apply_formatting(formatting, content)
+            return
+
         self.new_line()
-        self.recurse(self.node)
+        for node in content:
+            if isinstance(node, Text):
+                self.text(node)
+            else:
+                self.new_line()
 
         for line in self.children:
             line.layout()
 
         self.height = sum([line.height for line in self.children])
 
+        if key:
+            self.cache_formatting(key, content)
+
+    def formatting_key(self):
+        """The text nodes and line breaks laid out here, and a key for everything their formatting
+        depends on: the text, the font it's set in, line breaks, and the position and width available.
+        The key is None when there's too little text for caching to be worth it."""
+        content = []
+        text_length = 0
+        for node in walk_tree(self.node):
+            if isinstance(node, Text):
+                content.append(node)
+                text_length += len(node.text)
+            elif node.tag == "br":
+                content.append(node)
+
+        if text_length < MIN_CACHED_FORMATTING_TEXT:
+            return content, None
+
+        key = tuple((node.text, node.style["font-size"], node.style["font-weight"], node.style["font-style"])
+                    if isinstance(node, Text) else None for node in content)
+        return content, (self.x, self.width, key)
+
+    def cache_formatting(self, key, content):
+        """Stores the lines and words positioned relative to this layout, with words referring to their text node by index"""
+        global cached_formatting_words
+        if cached_formatting_words >= MAX_CACHED_FORMATTING_WORDS:
+            INLINE_FORMATTING.clear()
+            cached_formatting_words = 0
+
+        index = {id(node): i for i, node in enumerate(content)}
+        lines = []
+        for line in self.children:
+            words = [(index[id(word.node)], word.word, word.x - self.x, word.y - self.y,
+                      word.font, word.width, word.height) for word in line.children]
+            lines.append((line.y - self.y, line.height, words))
+            cached_formatting_words += len(words)
+
+        INLINE_FORMATTING[key] = (self.height, lines)
+
+    def apply_formatting(self, formatting, content):
+        self.height, lines = formatting
+        x, y = self.x, self.y
+        previous_line = None
+        for line_y, line_height, words in lines:
+            line = LineLayout(self.node, self, previous_line)
+            line.x, line.y, line.width, line.height = x, y + line_y, self.width, line_height
+
+            previous = None
+            for node_index, text, word_x, word_y, font, width, height in words:
+                previous = TextLayout(content[node_index], text, line, previous)
+                previous.x, previous.y = x + word_x, y + word_y
+                previous.font, previous.width, previous.height = font, width, height
+                line.children.append(previous)
+
+            self.children.append(line)
+            previous_line = line
+
     def paint(self, display_list):
+        # text nodes share their parent's style, so they'd otherwise repaint its (non-inherited) background
         bgcolor = self.node.style.get("background-color",
-                                      "transparent")
+                                      "transparent") if isinstance(self.node, Element) else "transparent"
         if bgcolor != "transparent":
             display_list.append(draw_bounding_rect(self, fill=bgcolor))
 
@@ -232,19 +472,6 @@ class InlineLayout:
         if SHOW_LAYOUTS['inline']:
             display_list.append(draw_bounding_rect(self, border_color='blue'))
 
-    def recurse(self, tree: Text | Element):
-        if isinstance(tree, Text):
-            self.text(tree)
-        else:
-            if tree.tag == "br":
-                self.new_line()
-
-            for child in tree.children:
-                self.recurse(child)
-
-            # if tree.tag == 'p':
-            #     self.new_line()
-
     def text(self, node):
         weight = node.style["font-weight"]
         style = node.style["font-style"]
@@ -254,27 +481,40 @@ class InlineLayout:
             style = "roman"
 
         # convert CSS pixels to TK points
-        size = int(float(node.style["font-size"][:-2]) * .75)
+        size = int(node.style["font-size"] * .75)
         font = get_font(size, weight, style)
 
         # TODO - figure out why this is funky
         right_margin = self.width
 
-        for word in node.text.split():
-            word_width = font.measure(word)
-            if self.cursor_x + word_width > right_margin:
-                before_hyphen, after_hyphen = maybe_hyphenate(
-                    word, lambda text: self.cursor_x + font.measure(text) > right_margin)
-
-                if before_hyphen != '':
-                    # we had room to put some of the word on this line
-                    self.add_text_to_current_line(before_hyphen + '-', node)
-                    word = after_hyphen
-
-                self.new_line()
-
+        space_width = measure(font, " ")
+        words, advances = measure_words(font, node.text)
+
+        i = 0
+        while i < len(words):
+            # every word that fits on the rest of this line is placed at once. advances[k] is how
+            # far the first k words (each with its trailing space) move the cursor.
+            room = right_margin - self.cursor_x + space_width + advances[i]
+            fits = bisect_right(advances, room, i + 1) - 1
+            self.add_words_to_current_line(words[i:fits], node)
+            self.cursor_x += advances[fits] - advances[i]
+            if fits == len(words):
+                break
+
+            # the next word doesn't fit, so it starts a new line, maybe leaving some of it on this one
+            word = words[fits]
+            before_hyphen, after_hyphen = maybe_hyphenate(
+                word, font, right_margin - self.cursor_x)
+
+            if before_hyphen != '':
+                # we had room to put some of the word on this line
+                self.add_text_to_current_line(before_hyphen + '-', node)
+                word = after_hyphen
+
+            self.new_line()
             self.add_text_to_current_line(word, node)
-            self.cursor_x += word_width + font.measure(" ")
+            self.cursor_x += advances[fits + 1] - advances[fits]
+            i = fits + 1
 
     def add_text_to_current_line(self, text, node):
         line = self.children[-1]
@@ -282,6 +522,15 @@ class InlineLayout:
         line.children.append(text)
         self.previous_word = text
 
+    def add_words_to_current_line(self, words, node):
+        line = self.children[-1]
+        add = line.children.append
+        previous = self.previous_word
+        for word in words:
+            previous = TextLayout(node, word, line, previous)
+            add(previous)
+        self.previous_word = previous
+
     def new_line(self):
         self.previous_word = None
         self.cursor_x = self.x
@@ -298,6 +547,35 @@ class BlockLayout:
         self.children = []
 
     def layout(self):
+        for _ in self.layout_steps():
+            pass
+
+    def layout_steps(self):
+        """Lays out the children one at a time, yielding each layout box once it is finished.
+        Inline children are yielded as soon as they are laid out, and a block is yielded after
+        all of its children, so a caller can pause between steps and paint what is finished so far."""
+        # nested blocks are tracked on an explicit stack rather than recursing,
+        # so deeply nested documents can't overflow Python's stack
+        stack = [(self, self.start_layout())]
+        while stack:
+            block, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                if stack:
+                    # height computation must happen after the children are laid out
+                    # since the parent should be tall enough to fit them all
+                    stack[-1][0].height += block.height
+                yield block
+            elif isinstance(child, BlockLayout):
+                stack.append((child, child.start_layout()))
+            else:
+                child.layout()
+                block.height += child.height
+                yield child
+
+    def start_layout(self):
+        """Positions this block and creates its children, returning an iterator over them to lay out"""
         self.width = self.parent.width
         self.x = self.parent.x
         if self.previous:
@@ -315,17 +593,25 @@ class BlockLayout:
             self.children.append(next)
             previous = next
 
-        for child in self.children:
-            child.layout()
-
-        # height computation must happen after the children are laid out
-        # since the parent should be tall enough to fit them all
-        self.height = sum([child.height for child in self.children])
+        self.height = 0
+        return iter(self.children)
 
     def paint(self, display_list):
-        for child in self.children:
-            child.paint(display_list)
+        # children paint before their block, without recursing, see layout_steps
+        stack = [(self, iter(self.children))]
+        while stack:
+            block, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                block.paint_self(display_list)
+            elif isinstance(child, BlockLayout):
+                stack.append((child, iter(child.children)))
+            else:
+                child.paint(display_list)
 
+    def paint_self(self, display_list):
+        """Paints this block's own decorations, excluding its children"""
         if SHOW_LAYOUTS['block']:
             display_list.append(draw_bounding_rect(
                 self, border_color='orange'))
@@ -338,18 +624,137 @@ class DocumentLayout:
         self.children = []
 
     def layout(self, width):
+        for _ in self.layout_steps(width):
+            pass
+
+    def layout_steps(self, width):
+        """Incrementally lays out the document, see BlockLayout.layout_steps.
+        While in progress, height covers only the content laid out so far."""
         child = BlockLayout(self.node, self, None)
         self.children.append(child)
 
         self.width = width - 2 * HSTEP
         self.x = HSTEP
         self.y = VSTEP
-        child.layout()
+        self.height = 2 * VSTEP
+        for finished in child.layout_steps():
+            self.height = max(self.height, finished.y +
+                              finished.height + VSTEP)
+            yield finished
+
         self.height = child.height + 2 * VSTEP
 
     def paint(self, display_list):
         self.children[0].paint(display_list)
+        self.paint_self(display_list)
 
+    def paint_self(self, display_list):
         if SHOW_LAYOUTS['document']:
             display_list.append(draw_bounding_rect(
                 self, border_color='purple'))
+
+
+# height in pixels of each row of the hit testing index
+HIT_TEST_BUCKET_HEIGHT = 64
+
+
+def enclosing_link(node, links: dict):
+    """Returns the href of the nearest <a> at or above node, memoizing results by node id in links"""
+    path = []
+    href = None
+    while node is not None:
+        if id(node) in links:
+            href = links[id(node)]
+            break
+        path.append(node)
+        if isinstance(node, Element) and node.tag == 'a' and 'href' in node.attributes:
+            href = node.attributes['href']
+            break
+        node = node.parent
+
+    for visited in path:
+        links[id(visited)] = href
+    return href
+
+
+class LayoutIndex:
+    """Spatial index over a laid out tree, added to as layout goes along.
+
+    Only boxes inside links matter for clicks, so just those are kept, bucketed into
+    fixed-height rows by their vertical extent so a hit test only considers the few
+    boxes overlapping the clicked row. Also maps element ids to their position for
+    fragment navigation. Holds plain data only, so it can be sent between processes."""
+
+    def __init__(self, document=None):
+        self.buckets = {}
+        self.ids = {}
+        # enclosing links memoized by node id, see enclosing_link. only kept while boxes are being added.
+        self.links = {}
+
+        if document is not None:
+            self.add_tree(document)
+            self.finish()
+
+    def add_tree(self, layout):
+        """Adds a laid out box and everything in it, children first, as layout finishes them"""
+        stack = [(layout, iter(layout.children))]
+        while stack:
+            box, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                self.add_box(box)
+            else:
+                stack.append((child, iter(child.children)))
+
+    def add_box(self, layout):
+        """Adds just the one box, once everything in it has been added"""
+        node = layout.node
+        if isinstance(node, Element) and 'id' in node.attributes:
+            # the first box for an id, which for a node with several is where they all start
+            self.ids.setdefault(node.attributes['id'], layout.y)
+
+        if layout.height <= 0 or layout.width <= 0:
+            return
+
+        href = enclosing_link(node, self.links)
+        if href is None:
+            return
+
+        box = (layout.x, layout.y, layout.width, layout.height, href)
+        first = int(layout.y // HIT_TEST_BUCKET_HEIGHT)
+        last = int((layout.y + layout.height) // HIT_TEST_BUCKET_HEIGHT)
+        for bucket in range(first, last + 1):
+            self.buckets.setdefault(bucket, []).append(box)
+
+    def finish(self):
+        """Called once the whole tree has been added, to let go of what's only needed while adding"""
+        self.links = {}
+
+    def link_at(self, x, y):
+        """Returns the href of the deepest link containing the point, if any"""
+        candidates = self.buckets.get(int(y // HIT_TEST_BUCKET_HEIGHT), [])
+        # boxes are added after everything in them, so the first one containing the point is the deepest
+        for left, top, width, height, href in candidates:
+            if left <= x < left + width and top <= y < top + height:
+                return href
+        return None
+
+    def find_id(self, id):
+        """Returns the y position of the element with the given id, if any"""
+        return self.ids.get(id, None)
+
+
+class RenderedPage:
+    """A laid out and painted page in a compact form that can be sent between processes.
+    Stands in for the DocumentLayout of a page rendered elsewhere."""
+
+    def __init__(self, height=0, display_list=None, layout_index=None):
+        self.height = height
+        # serialized, see serialize_display_list
+        self.display_list = display_list or []
+        self.layout_index = layout_index or LayoutIndex()
+
+    @staticmethod
+    def from_document(document, display_list):
+        return RenderedPage(document.height, serialize_display_list(display_list), LayoutIndex(document))
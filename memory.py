@@ -0,0 +1,31 @@
+"""Rough accounting of the memory a page holds on to.
+
+Walking the heap is far too slow to do while browsing, so these estimates count
+the objects a page keeps alive and multiply by their typical sizes instead.
+"""
+from dom import walk_tree
+
+# rough sizes of the objects a page holds on to, see benchmarks/memory.py
+BYTES_PER_NODE = 250
+BYTES_PER_DISPLAY_ITEM = 400
+BYTES_PER_SERIALIZED_ITEM = 150
+
+
+def estimate_dom_memory(nodes) -> int:
+    if nodes is None:
+        return 0
+    return sum(BYTES_PER_NODE + len(getattr(node, "text", ""))
+               for node in walk_tree(nodes))
+
+
+def estimate_display_list_memory(display_list, serialized=False) -> int:
+    """Estimates the bytes used by a display list and the layout tree that painted it.
+    A serialized display list (rendered in a worker) has no layout tree behind it."""
+    per_item = BYTES_PER_SERIALIZED_ITEM if serialized else BYTES_PER_DISPLAY_ITEM
+    return len(display_list) * per_item
+
+
+def estimate_page_memory(nodes, display_list) -> int:
+    """Estimates how many bytes a page's DOM, layout tree and display list take up"""
+    return estimate_dom_memory(nodes) + \
+        estimate_display_list_memory(display_list, serialized=nodes is None)
@@ -0,0 +1,173 @@
+"""Renders pages in worker processes.
+
+Fetching, parsing, styling and layout are CPU-bound Python, so running them on
+the UI thread means only one page can make progress at a time. A RenderPool runs
+the whole pipeline in separate processes (measuring text with HeadlessFont) and
+sends back a RenderedPage for the UI process to draw.
+
+This module is also a headless command line renderer for processing pages in bulk:
+
+    python render.py --width 800 --workers 8 --out renders/ page.html https://example.org/
+
+Each page's display list is written to the output directory as JSON, along with
+a timings.json summarizing how long every page spent in each stage.
+"""
+import json
+import multiprocessing
+import sys
+from concurrent.futures import Future, ProcessPoolExecutor
+from os import makedirs
+from os.path import abspath, join
+from time import perf_counter
+
+import tracing
+from browser import load_default_style_sheet, load_document
+from dom import only_body
+from layout import DocumentLayout, RenderedPage, use_headless_fonts
+
+# the user agent style sheet, parsed once per worker
+DEFAULT_STYLE_SHEET = None
+
+STAGES = ["fetch", "parse", "stylesheets", "style", "layout", "paint"]
+
+
+def init_worker():
+    global DEFAULT_STYLE_SHEET
+    use_headless_fonts()
+    DEFAULT_STYLE_SHEET = load_default_style_sheet()
+
+
+def render_page(url: str, width: int) -> RenderedPage:
+    nodes = load_document(url, DEFAULT_STYLE_SHEET)
+
+    with tracing.span("layout"):
+        document = DocumentLayout(only_body(nodes))
+        document.layout(width)
+
+    with tracing.span("paint"):
+        display_list = []
+        document.paint(display_list)
+
+    tracing.count("display list items", len(display_list))
+    return RenderedPage.from_document(document, display_list)
+
+
+class RenderPool:
+    def __init__(self, workers: int):
+        # spawn rather than fork, since forking a process that has Tk loaded isn't safe
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+        )
+
+    def submit(self, url: str, width: int) -> Future:
+        return self.executor.submit(render_page, url, width)
+
+    def map(self, fn, *iterables, chunksize=1):
+        return self.executor.map(fn, *iterables, chunksize=chunksize)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def to_url(source: str) -> str:
+    """Command line sources may be URLs or paths to local files"""
+    if "://" in source or source.startswith(("data:", "view-source:")):
+        return source
+    return "file://" + abspath(source)
+
+
+def render_to_file(job):
+    """Renders one page and writes its display list to a JSON file.
+    Writing from the worker keeps large display lists from being sent back to the parent process."""
+    index, url, width, out_dir = job
+    result = {"url": url, "file": None, "error": None}
+
+    trace = tracing.start()
+    try:
+        with tracing.span("total"):
+            page = render_page(url, width)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        return result
+    finally:
+        tracing.stop()
+        result["timings"] = trace.durations()
+        result["counters"] = trace.counters
+
+    result["file"] = f"{index:06}.json"
+    with open(join(out_dir, result["file"]), "w") as f:
+        json.dump({
+            "url": url,
+            "width": width,
+            "height": page.height,
+            "display_list": page.display_list,
+        }, f, separators=(",", ":"))
+
+    return result
+
+
+def render_all(urls, width: int, out_dir: str, workers: int):
+    makedirs(out_dir, exist_ok=True)
+    jobs = [(i, url, width, out_dir) for i, url in enumerate(urls)]
+
+    start = perf_counter()
+    if workers > 1:
+        pool = RenderPool(workers)
+        # batch jobs so per-page IPC doesn't dominate for small pages
+        chunksize = max(1, len(jobs) // (workers * 4))
+        results = list(pool.map(render_to_file, jobs, chunksize=chunksize))
+        pool.shutdown()
+    else:
+        init_worker()
+        results = [render_to_file(job) for job in jobs]
+    elapsed = perf_counter() - start
+
+    totals = {stage: sum(result["timings"].get(stage, 0) for result in results)
+              for stage in STAGES + ["total"]}
+    failures = [result for result in results if result["error"]]
+
+    with open(join(out_dir, "timings.json"), "w") as f:
+        json.dump({
+            "width": width,
+            "workers": workers,
+            "wall_time": elapsed,
+            "totals": totals,
+            "pages": results,
+        }, f, indent=2)
+
+    print(f"rendered {len(results) - len(failures)}/{len(results)} pages "
+          f"in {elapsed:.2f}s with {workers} workers ({len(results) / elapsed:.1f} pages/s)")
+    for stage in STAGES:
+        print(f"  {stage:<12}{totals[stage]:>9.2f}s")
+    for failure in failures:
+        print(f"  failed {failure['url']}: {failure['error']}", file=sys.stderr)
+
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Render pages headlessly, writing their display lists and per-stage timings")
+    parser.add_argument("sources", nargs="*",
+                        help="URLs or paths to local files")
+    parser.add_argument("-i", "--input",
+                        help="file listing URLs or paths, one per line")
+    parser.add_argument("-w", "--width", type=int, default=800)
+    parser.add_argument("-j", "--workers", type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument("-o", "--out", default="renders")
+    args = parser.parse_args()
+
+    sources = list(args.sources)
+    if args.input:
+        with open(args.input) as f:
+            sources.extend(line.strip() for line in f if line.strip())
+
+    if not sources:
+        parser.error("nothing to render")
+
+    render_all([to_url(source) for source in sources],
+               args.width, args.out, args.workers)
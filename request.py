@@ -3,6 +3,8 @@ from gzip import decompress
 import socket
 import ssl
 
+import http2
+import tracing
 from cache import Cache
 
 MAX_REDIRECT_COUNT = 5
@@ -25,32 +27,71 @@ def parse_url(url: str):
     return scheme, host, port, path
 
 
-def fetch_response(scheme: str, host: str, port: str, path: str, accept_compressed=True):
+def open_socket(scheme: str, host: str, port: int):
     s = socket.socket(
         family=socket.AF_INET,
         type=socket.SOCK_STREAM,
         proto=socket.IPPROTO_TCP,
     )
 
-    if not port:
-        port = 80 if scheme == "http" else 443
-
     s.connect((host, port))
 
     if scheme == "https":
         ctx = ssl.create_default_context()
+        # offer HTTP/2, the server picks HTTP/1.1 if it doesn't speak it
+        ctx.set_alpn_protocols(["h2", "http/1.1"])
         s = ctx.wrap_socket(s, server_hostname=host)
 
+    return s
+
+
+def speaks_http2(s, host: str, port: int) -> bool:
+    if isinstance(s, ssl.SSLSocket):
+        return s.selected_alpn_protocol() == "h2"
+    return (host, port) in http2.PRIOR_KNOWLEDGE
+
+
+def fetch_response(scheme: str, host: str, port: str, path: str, accept_compressed=True):
+    if not port:
+        port = 80 if scheme == "http" else 443
+    else:
+        port = int(port)
+
+    origin = (scheme, host, port)
+    headers = {"User-Agent": "Andrew's Toy Browser"}
+    if accept_compressed:
+        headers["Accept-Encoding"] = "gzip"
+
+    # requests to an origin that speaks HTTP/2 share one connection
+    connection = http2.pooled_connection(origin)
+    if connection:
+        try:
+            return connection.fetch(scheme, host, port, path, headers)
+        except ConnectionError:
+            if connection.usable():
+                # just this request failed
+                raise
+            # the server may have closed the connection while it was idle, so try a new one
+            http2.forget_connection(origin, connection)
+
+    s = open_socket(scheme, host, port)
+
+    if speaks_http2(s, host, port):
+        tracing.count("http2 connections")
+        connection = http2.add_connection(origin, http2.HTTP2Connection(s))
+        return connection.fetch(scheme, host, port, path, headers)
+
+    return fetch_http1_response(s, host, path, headers)
+
+
+def fetch_http1_response(s, host: str, path: str, headers: dict) -> bytes:
     default_headers = {
         "Host": host,
-        "User-Agent": "Andrew's Toy Browser",
+        **headers,
         # see https://datatracker.ietf.org/doc/html/rfc2068#section-8.1.2.1 for more details
         "Connection": "close"
     }
 
-    if accept_compressed:
-        default_headers["Accept-Encoding"] = "gzip"
-
     request = f"GET {path} HTTP/1.1\r\n"
 
     for key, val in default_headers.items():
@@ -114,6 +155,7 @@ def request_remote(url: str):
 
         if response:
             cache_hit = True
+            tracing.count("cache hits")
         else:
             scheme, host, port, path = parse_url(url)
 
@@ -122,6 +164,7 @@ def request_remote(url: str):
 
             response = fetch_response(
                 scheme, host, port, path, accept_compressed=False)
+            tracing.count("bytes fetched", len(response))
 
         status, explanation, headers, body = extract_response_info(
             response)
@@ -152,7 +195,9 @@ def request_remote(url: str):
 
 def request_local(path: str) -> str:
     with open(path) as file:
-        return file.read()
+        body = file.read()
+    tracing.count("bytes fetched", len(body))
+    return body
 
 
 def parse_data_url(url: str) -> list:
@@ -168,6 +213,9 @@ def request_url(url: str):
         content_type, response_body = parse_data_url(url)
         return headers, response_body
 
+    # fragments only matter to the browser, they're never part of the request
+    url, _, _ = url.partition("#")
+
     scheme, host, port, path = parse_url(url)
 
     if scheme in ["http", "https"]:
@@ -184,6 +232,9 @@ def request_url(url: str):
 def resolve_url(url: str, current: str):
     if "://" in url:
         return url
+    elif url.startswith("#"):
+        page, _, _ = current.partition("#")
+        return page + url
     elif url.startswith("/"):
         scheme, hostpath = current.split("://", 1)
         host, oldpath = hostpath.split("/", 1)
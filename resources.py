@@ -0,0 +1,150 @@
+"""Schedules every network load, most important first.
+
+Loads are queued with a priority class and (optionally) the tab they're for, and run
+on a few worker threads, most important first and in the order they were asked for
+within a class. At most MAX_LOADS run at once, and at most MAX_LOADS_PER_HOST of them
+to the same host, so a burst of less important loads can't hold up the next
+navigation for long, or swamp one server.
+
+While a tab is in the background its loads are demoted to BACKGROUND, and they're
+cancelled when it navigates away or is discarded. Loads already running aren't
+interrupted, but their results are ignored.
+"""
+import threading
+from concurrent.futures import Future
+from itertools import count
+
+import tracing
+from request import request_url
+
+# priority classes, most important first
+NAVIGATION = 0
+RENDER_BLOCKING = 1
+VISIBLE = 2
+BACKGROUND = 3
+SPECULATIVE = 4
+
+MAX_LOADS = 10
+MAX_LOADS_PER_HOST = 6
+
+
+def host_of(url: str):
+    """Loads from the same host share a limit. Local files and data: URLs don't have one."""
+    scheme, separator, rest = url.partition("://")
+    if not separator or scheme == "file":
+        return None
+    return rest.split("/", 1)[0]
+
+
+class Load:
+    __slots__ = ("fn", "url", "priority", "owner", "host", "order", "future")
+
+    def __init__(self, fn, url: str, priority: int, owner, order: int):
+        self.fn = fn
+        self.url = url
+        self.priority = priority
+        self.owner = owner
+        self.host = host_of(url)
+        self.order = order
+        self.future = Future()
+
+
+class ResourceScheduler:
+    def __init__(self, max_loads: int = MAX_LOADS, max_loads_per_host: int = MAX_LOADS_PER_HOST):
+        self.max_loads = max_loads
+        self.max_loads_per_host = max_loads_per_host
+
+        # guards everything below, and wakes workers up when there may be a load they can run
+        self.condition = threading.Condition()
+        self.queue = []
+        self.running_per_host = {}
+        # owners (tabs) whose loads are demoted to BACKGROUND
+        self.background_owners = set()
+        self.order = count()
+        self.workers = []
+
+    def submit(self, fn, url: str, priority: int, owner=None) -> Future:
+        """Queues fn(url) to run on a worker thread, returning a future for its result"""
+        with self.condition:
+            if not self.workers:
+                self.start_workers()
+            load = Load(fn, url, priority, owner, next(self.order))
+            self.queue.append(load)
+            self.condition.notify()
+        return load.future
+
+    def fetch(self, url: str, priority: int, owner=None):
+        """Requests url, waiting for its turn and then the response"""
+        return self.submit(request_url, url, priority, owner).result()
+
+    def cancel(self, owner) -> int:
+        """Cancels owner's loads that haven't started yet, returning how many there were"""
+        with self.condition:
+            cancelled = [load for load in self.queue if load.owner is owner]
+            self.queue = [load for load in self.queue if load.owner is not owner]
+
+        for load in cancelled:
+            load.future.cancel()
+        if cancelled:
+            tracing.count("loads cancelled", len(cancelled))
+        return len(cancelled)
+
+    def set_background(self, owner, background: bool):
+        with self.condition:
+            if background:
+                self.background_owners.add(owner)
+            else:
+                self.background_owners.discard(owner)
+                self.condition.notify_all()
+
+    def effective_priority(self, load: Load) -> int:
+        if load.owner in self.background_owners:
+            return max(load.priority, BACKGROUND)
+        return load.priority
+
+    def next_load(self):
+        """Takes the most important queued load whose host isn't at its limit, if there is one"""
+        best = None
+        for load in self.queue:
+            if self.running_per_host.get(load.host, 0) >= self.max_loads_per_host \
+                    and load.host is not None:
+                continue
+            if best is None or (self.effective_priority(load), load.order) < \
+                    (self.effective_priority(best), best.order):
+                best = load
+
+        if best:
+            self.queue.remove(best)
+        return best
+
+    def start_workers(self):
+        for _ in range(self.max_loads):
+            worker = threading.Thread(
+                target=self.work, name="resources", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def work(self):
+        while True:
+            with self.condition:
+                load = self.next_load()
+                while load is None:
+                    self.condition.wait()
+                    load = self.next_load()
+                self.running_per_host[load.host] = self.running_per_host.get(
+                    load.host, 0) + 1
+
+            try:
+                if load.future.set_running_or_notify_cancel():
+                    try:
+                        load.future.set_result(load.fn(load.url))
+                    except BaseException as e:
+                        load.future.set_exception(e)
+            finally:
+                with self.condition:
+                    self.running_per_host[load.host] -= 1
+                    # a load that was held back by its host's limit may be able to run now
+                    self.condition.notify_all()
+
+
+SCHEDULER = ResourceScheduler()
@@ -0,0 +1,31 @@
+import sys
+from os.path import dirname
+
+import pytest
+
+# the browser's modules sit at the top of the repository, not in a package
+sys.path.insert(0, dirname(dirname(__file__)))
+
+import domcache
+from layout import use_headless_fonts
+
+
+@pytest.fixture(autouse=True)
+def headless(monkeypatch):
+    use_headless_fonts()
+    # pages written by one test would otherwise be loaded from another's DOM snapshots
+    monkeypatch.setattr(domcache, "ENABLED", False)
+
+
+@pytest.fixture
+def pages(tmp_path):
+    """Writes pages (a dict of file names to HTML) to a temporary directory,
+    returning their file: URLs by name"""
+    def write(files: dict) -> dict:
+        urls = {}
+        for name, html in files.items():
+            path = tmp_path / name
+            path.write_text(html)
+            urls[name] = f"file://{path}"
+        return urls
+    return write
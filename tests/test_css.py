@@ -0,0 +1,76 @@
+import pytest
+
+import css
+from css import CSSParser, parse_selector
+
+RED = {"color": "red"}
+BLUE = {"color": "blue"}
+
+# style sheets, and the rules they should parse to
+SHEETS = [
+    # strings can have braces and ; in them
+    ('a { content: "}"; color: red } p { color: blue }', [("a", RED), ("p", BLUE)]),
+    ("a { content: '{;}'; color: red } p { color: blue }", [("a", RED), ("p", BLUE)]),
+    ('a { content: "x;y"; color: red; font-size: 12px }', [("a", {"color": "red", "font-size": "12.0px"})]),
+    ('p { color: "a\\"}"; font-size: 5px } a { color: red }', [("p", {"font-size": "5.0px"}), ("a", RED)]),
+    ("a { content: \"it's\"; color: red } p { color: blue }", [("a", RED), ("p", BLUE)]),
+    ('@font-face { font-family: "a}b" } p { color: blue }', [("p", BLUE)]),
+    ('@media "}" { a { color: red } } p { color: blue }', [("p", BLUE)]),
+    # at-rules are skipped, blocks and all, however deeply they're nested
+    ("@media screen { @supports (display: grid) { a { color: red } } p { color: red } } b { color: blue }",
+     [("b", BLUE)]),
+    ('@media print { a { color: red } } @import "x.css"; b { color: blue }', [("b", BLUE)]),
+    ("@x{}p{color:blue}", [("p", BLUE)]),
+    ("@media screen { a { color: red } b { color: blue }", []),
+    # and at-rules in strings are just strings
+    ('a { content: "@media { ; } "; color: red } p { color: blue }', [("a", RED), ("p", BLUE)]),
+    ('a { content: "@media"; color: red } @x { } p { color: blue }', [("a", RED), ("p", BLUE)]),
+    ('"@media {" p { color: blue } a { color: red }', [("a", RED)]),
+    # comments that aren't closed run to the end
+    ("a { color: red } /* p { color: blue }", [("a", RED)]),
+    ("a { color: red /* } */ } p { color: blue }", [("a", RED), ("p", BLUE)]),
+    # strings that aren't closed are just a quote, and can't run onto the next line
+    ('a { content: "unterminated; color: red } p { color: blue }', [("a", RED), ("p", BLUE)]),
+    ("a { content: 'unterminated\n; color: red } p { color: blue }", [("a", RED), ("p", BLUE)]),
+    # bad selectors skip their rule, and a rule that's never closed ends the sheet
+    ("a[href] { color: red } p { color: blue }", [("p", BLUE)]),
+    ("p { color: blue } a { color: red", [("p", BLUE)]),
+]
+
+
+def parse(sheet: str) -> list:
+    """The rules in sheet, written out so they can be compared"""
+    return [(repr(selector), {prop: str(value) for prop, value in body.items()})
+            for selector, body in CSSParser(sheet).parse()]
+
+
+@pytest.mark.parametrize("sheet, expected", SHEETS)
+def test_parse(sheet, expected):
+    assert parse(sheet) == expected
+
+
+@pytest.mark.parametrize("sheet, expected", SHEETS)
+def test_parse_with_braces_in_strings_elsewhere(sheet, expected):
+    # a string with braces in it anywhere means every string in the sheet has to be looked at
+    assert parse("q { content: '{;}' }" + sheet) == [("q", {})] + expected
+
+
+class EmptiedAfterEachLookup(dict):
+    """A cache that another thread empties straight after every lookup"""
+
+    def __contains__(self, key):
+        found = super().__contains__(key)
+        self.clear()
+        return found
+
+    def get(self, key, default=None):
+        value = super().get(key, default)
+        self.clear()
+        return value
+
+
+def test_selector_cache_emptied_by_another_thread(monkeypatch):
+    cached = parse_selector("h1 p")
+    selectors = EmptiedAfterEachLookup({"h1 p": cached})
+    monkeypatch.setattr(css, "SELECTORS", selectors)
+    assert parse_selector("h1 p") is cached
@@ -0,0 +1,7 @@
+from benchmarks.h2c import check_hpack, check_http2
+
+
+def test_against_local_server():
+    # see benchmarks/h2c.py for what each check does
+    failed = [name for name, ok in check_hpack() + check_http2() if not ok]
+    assert failed == []
@@ -0,0 +1,137 @@
+from browser import Tab
+
+
+class Tasks:
+    """Stands in for the browser's event loop, running scheduled tasks when asked"""
+
+    def __init__(self):
+        self.tasks = []
+
+    def schedule(self, task, delay_ms=None):
+        self.tasks.append(task)
+
+    def run(self):
+        while self.tasks:
+            self.tasks.pop(0)()
+
+
+def page(body: str) -> str:
+    return f"<html><head><title>test</title></head><body>{body}</body></html>"
+
+
+def make_tab(**options):
+    tasks = Tasks()
+    return Tab(800, 600, lambda: None, tasks.schedule, **options), tasks
+
+
+def shown_text(tab) -> str:
+    tab.finish_layout()
+    return " ".join(command.text for command in tab.display_list if hasattr(command, "text"))
+
+
+def test_back_twice_after_eviction(pages):
+    urls = pages({name: page(f"<p>page {name}</p>") for name in "abc"})
+    tab, tasks = make_tab()
+    for name in "abc":
+        tab.load(urls[name])
+
+    # b was dropped from the bfcache, so going back to it loads it again
+    tab.bfcache.discard((tab.id, 1))
+    tab.go_back()
+    assert tab.history == [urls["a"], urls["b"]]
+    assert shown_text(tab) == "page b"
+
+    tab.go_back()
+    assert tab.history == [urls["a"]]
+    assert shown_text(tab) == "page a"
+
+
+def test_back_restores_from_bfcache(pages):
+    urls = pages({name: page(f"<p>page {name}</p>") for name in "ab"})
+    tab, tasks = make_tab()
+    tab.load(urls["a"])
+    document = tab.document
+    tab.load(urls["b"])
+
+    tab.go_back()
+    assert tab.document is document
+    assert tab.history == [urls["a"]]
+
+
+def fragment_page(pages):
+    # the stylesheet makes everything before the target taller
+    filler = "<p>filler</p>" * 50
+    urls = pages({
+        "big.css": "p { font-size: 300% }",
+        "fragment.html": page(f'<link rel="stylesheet" href="big.css">{filler}<p id="target">here</p>'),
+    })
+    return urls["fragment.html"] + "#target"
+
+
+def test_fragment_followed_after_stylesheets_arrive(pages):
+    url = fragment_page(pages)
+    tab, tasks = make_tab(progressive_css=True)
+    tab.load(url)
+    unstyled = tab.scroll
+
+    tasks.run()
+    assert tab.pending_stylesheets is None
+    assert tab.scroll > unstyled
+    assert tab.scroll == tab.layout_index.find_id("target")
+
+
+def test_fragment_not_followed_after_scrolling(pages):
+    url = fragment_page(pages)
+    tab, tasks = make_tab(progressive_css=True)
+    tab.load(url)
+    tab.scrollup()
+    scrolled = tab.scroll
+
+    tasks.run()
+    assert tab.pending_stylesheets is None
+    assert tab.scroll == scrolled
+
+
+def long_page(pages):
+    paragraphs = "".join(f'<p id="p{i}">paragraph {i} <a href="#p{i}">link</a></p>' for i in range(2000))
+    return pages({"long.html": page(f'<p><a href="target.html">top link</a></p>{paragraphs}'),
+                  "target.html": page("<p>target</p>")})
+
+
+def test_click_without_laying_out_the_whole_page(pages):
+    urls = long_page(pages)
+    tab, tasks = make_tab()
+    tab.load(urls["long.html"])
+
+    # nowhere near a link
+    tab.click(700, 5)
+    assert not tab.layout_complete
+    assert tab.history == [urls["long.html"]]
+
+    left, top, width, height, href = tab.layout_index.buckets[0][0]
+    assert href == "target.html"
+    tab.click(left + 1, top + 1)
+    assert tab.history == [urls["long.html"], urls["target.html"]]
+
+
+def test_index_built_as_layout_goes_matches_one_built_after(pages):
+    from layout import LayoutIndex
+
+    urls = long_page(pages)
+    tab, tasks = make_tab()
+    tab.load(urls["long.html"])
+    tasks.run()
+    assert tab.layout_complete
+
+    whole = LayoutIndex(tab.document)
+    assert tab.layout_index.buckets == whole.buckets
+    assert tab.layout_index.ids == whole.ids
+
+
+def test_fragment_without_laying_out_the_whole_page(pages):
+    urls = long_page(pages)
+    tab, tasks = make_tab()
+    tab.load(urls["long.html"] + "#p1000")
+    assert tab.scroll > 0
+    assert tab.scroll == tab.layout_index.find_id("p1000")
+    assert not tab.layout_complete
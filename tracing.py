@@ -0,0 +1,131 @@
+"""Lightweight instrumentation of where the time goes when loading a page.
+
+Stages are wrapped in spans and interesting quantities are tallied in counters:
+
+    with tracing.span("parse"):
+        ...
+    tracing.count("bytes fetched", len(body))
+
+Tracing is off until start() is called. While it is off, span() hands back a shared
+no-op context manager and count() returns straight away, so instrumented code costs
+next to nothing. A finished trace can be exported in Chrome's trace event format and
+opened in chrome://tracing or https://ui.perfetto.dev.
+"""
+import json
+import threading
+from collections import deque
+from os import getpid
+from time import perf_counter
+
+
+# most spans and counter samples a trace keeps, dropping the oldest first, so a
+# browser left running with tracing on doesn't grow without bound
+MAX_EVENTS = 100_000
+
+
+class Trace:
+    def __init__(self, max_events: int = MAX_EVENTS):
+        self.origin = perf_counter()
+        # (name, start, duration), in seconds since the trace started
+        self.spans = deque(maxlen=max_events)
+        self.counters = {}
+        # (name, time, value) each time a counter changes
+        self.counter_samples = deque(maxlen=max_events)
+        # the most recent duration of each span, e.g. for showing the last page load
+        self.latest = {}
+        # spans and counts come from the resource loading and cache writer threads too
+        self.lock = threading.Lock()
+
+    def add_span(self, name: str, start: float, duration: float):
+        with self.lock:
+            self.spans.append((name, start - self.origin, duration))
+            self.latest[name] = duration
+
+    def count(self, name: str, amount=1):
+        with self.lock:
+            value = self.counters.get(name, 0) + amount
+            self.counters[name] = value
+            self.counter_samples.append((name, perf_counter() - self.origin, value))
+
+    def durations(self) -> dict:
+        """Total seconds spent in each span"""
+        totals = {}
+        with self.lock:
+            spans = list(self.spans)
+        for name, _, duration in spans:
+            totals[name] = totals.get(name, 0) + duration
+        return totals
+
+    def to_chrome_trace(self) -> dict:
+        pid = getpid()
+        with self.lock:
+            spans, counter_samples = list(self.spans), list(self.counter_samples)
+        events = [{"name": name, "cat": "pipeline", "ph": "X", "pid": pid, "tid": 0,
+                   "ts": start * 1e6, "dur": duration * 1e6}
+                  for name, start, duration in spans]
+        events.extend({"name": name, "ph": "C", "pid": pid, "tid": 0,
+                       "ts": time * 1e6, "args": {name: value}}
+                      for name, time, value in counter_samples)
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.to_chrome_trace(), f)
+
+
+class Span:
+    __slots__ = ("trace", "name", "start")
+
+    def __init__(self, trace: Trace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.trace.add_span(self.name, self.start, perf_counter() - self.start)
+
+
+class NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NO_SPAN = NoSpan()
+
+# the trace being recorded, or None when tracing is off
+CURRENT = None
+
+
+def start() -> Trace:
+    global CURRENT
+    CURRENT = Trace()
+    return CURRENT
+
+
+def stop() -> Trace:
+    global CURRENT
+    trace, CURRENT = CURRENT, None
+    return trace
+
+
+def enabled() -> bool:
+    return CURRENT is not None
+
+
+def span(name: str):
+    if CURRENT is None:
+        return NO_SPAN
+    return Span(CURRENT, name)
+
+
+def count(name: str, amount=1):
+    if CURRENT is not None:
+        CURRENT.count(name, amount)